@@ -0,0 +1,145 @@
+import os
+import shutil
+import tempfile
+import subprocess
+import numpy as np
+
+# Formats libsndfile reads natively and can seek in; everything else (mp3, m4a, ...) is
+# streamed through ffmpeg, which decodes them much faster than audioread
+NATIVE_EXTENSIONS = ('.wav', '.flac', '.ogg', '.aiff', '.aif')
+BLOCK_FRAMES = 65536
+DEFAULT_SR = 22050
+
+def ffmpeg_available():
+    return shutil.which('ffmpeg') is not None
+
+def decode(path, sr=DEFAULT_SR, mono=True, offset=0.0, duration=None):
+    """
+    Decode an audio file into a float32 buffer, block by block
+    Drop-in for librosa.load: sr=None keeps the native rate, mono=False returns
+    (channels, samples). offset/duration (seconds) read an excerpt without decoding
+    the rest of the file
+    Returns (y, sr)
+    """
+    if path.lower().endswith(NATIVE_EXTENSIONS):
+        y, native_sr = _decode_native(path, mono, offset, duration)
+    elif ffmpeg_available():
+        return _decode_ffmpeg(path, sr, mono, offset, duration)
+    else:
+        # No ffmpeg on this machine, fall back to librosa's audioread path
+        import librosa
+        return librosa.load(path, sr=sr, mono=mono, offset=offset, duration=duration, dtype=np.float32)
+
+    if sr is not None and sr != native_sr:
+        import librosa
+        y = librosa.resample(y, orig_sr=native_sr, target_sr=sr)
+        native_sr = sr
+    return y, native_sr
+
+def audio_info(path):
+    """
+    Duration, sample rate and channel count of a file without decoding it
+    Returns (duration_seconds, sr, channels)
+    """
+    if path.lower().endswith(NATIVE_EXTENSIONS):
+        import soundfile as sf
+        info = sf.info(path)
+        return info.frames / info.samplerate, info.samplerate, info.channels
+    if ffmpeg_available():
+        return _probe(path, 'duration', format_entry=True), _probe(path, 'sample_rate'), _probe(path, 'channels')
+
+    import librosa
+    return librosa.get_duration(path=path), librosa.get_samplerate(path), 2
+
+def _decode_native(path, mono, offset, duration):
+    import soundfile as sf
+
+    with sf.SoundFile(path) as f:
+        start = min(int(round(offset * f.samplerate)), f.frames)
+        frames = f.frames - start
+        if duration is not None:
+            frames = min(frames, int(round(duration * f.samplerate)))
+        f.seek(start)
+
+        # Read straight into the output buffer, averaging channels block by block for mono
+        y = np.empty(frames if mono else (f.channels, frames), dtype=np.float32)
+        block = np.empty((min(BLOCK_FRAMES, max(frames, 1)), f.channels), dtype=np.float32)
+        pos = 0
+        while pos < frames:
+            n = f.read(min(BLOCK_FRAMES, frames - pos), dtype='float32', always_2d=True,
+                       out=block[:min(BLOCK_FRAMES, frames - pos)]).shape[0]
+            if n == 0:
+                break
+            if mono:
+                np.mean(block[:n], axis=1, out=y[pos:pos + n])
+            else:
+                y[:, pos:pos + n] = block[:n].T
+            pos += n
+        return y[..., :pos], f.samplerate
+
+def _probe(path, entry, format_entry=False):
+    """
+    Read one property of the first audio stream, e.g. 'channels', via ffprobe
+    format_entry reads a container property (float) such as 'duration' instead
+    """
+    section = 'format' if format_entry else 'stream'
+    result = subprocess.run(
+        ['ffprobe', '-v', 'error', '-select_streams', 'a:0', '-show_entries', f'{section}={entry}',
+         '-of', 'default=noprint_wrappers=1:nokey=1', path],
+        capture_output=True, text=True
+    )
+    try:
+        value = result.stdout.split()[0]
+        return float(value) if format_entry else int(value)
+    except (IndexError, ValueError):
+        raise RuntimeError(f"Could not read the {entry} of {path}: {result.stderr.strip()}")
+
+def _decode_ffmpeg(path, sr, mono, offset, duration):
+    if sr is None:
+        sr = _probe(path, 'sample_rate')
+    channels = 1 if mono else _probe(path, 'channels')
+
+    # -ss before -i seeks in the input instead of decoding up to the offset
+    command = ['ffmpeg', '-nostdin', '-v', 'error']
+    if offset:
+        command += ['-ss', str(offset)]
+    if duration is not None:
+        command += ['-t', str(duration)]
+    command += ['-i', path, '-vn', '-f', 'f32le', '-acodec', 'pcm_f32le',
+                '-ac', str(channels), '-ar', str(sr), '-']
+
+    # Size the buffer for the requested window (or a few minutes) and grow it when needed
+    expected = int((duration if duration is not None else 300) * sr) + BLOCK_FRAMES
+    buffer = np.empty(expected * channels, dtype=np.float32)
+    pos = 0
+    # stderr goes to a file: an undrained pipe fills up on noisy input and deadlocks ffmpeg
+    with tempfile.TemporaryFile() as error_log, \
+         subprocess.Popen(command, stdout=subprocess.PIPE, stderr=error_log) as process:
+        while True:
+            if len(buffer) - pos < BLOCK_FRAMES * channels:
+                buffer = np.resize(buffer, len(buffer) * 2)
+            view = memoryview(buffer[pos:pos + BLOCK_FRAMES * channels]).cast('B')
+            n = process.stdout.readinto(view)
+            if not n:
+                break
+            # Pipe reads may end mid-sample; finish the partial float before continuing
+            while n % 4:
+                extra = process.stdout.readinto(view[n:])
+                if not extra:
+                    break
+                n += extra
+            pos += n // 4
+        process.wait()
+        error_log.seek(0)
+        # The last lines carry the actual error, earlier ones are usually per-frame warnings
+        stderr = '\n'.join(error_log.read().decode(errors='replace').strip().splitlines()[-10:])
+
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg could not decode {os.path.basename(path)}: {stderr}")
+
+    pos -= pos % channels
+    # Don't keep a mostly empty buffer alive behind a short view
+    y = buffer[:pos] if pos > len(buffer) * 0.75 else buffer[:pos].copy()
+    if channels > 1:
+        y = y.reshape(-1, channels).T
+    return np.ascontiguousarray(y), sr
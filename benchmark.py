@@ -0,0 +1,304 @@
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Modules the user launches directly; all of them should start without loading torch/librosa
+ENTRY_MODULES = ['split_stems', 'job_server', 'pipeline', 'shard_worker', 'audio_decoder',
+                 'step1_BPMAnalysis', 'step2_KeyAnalysis',
+                 'step3_1_StemSeperation', 'step3_2_DrumSeperation',
+                 'step4_ChopSegments8Bars']
+
+def measure_import_time(module):
+    """
+    Import a module in a fresh interpreter with -X importtime
+    Returns (total_us, [(cumulative_us, name), ...]) sorted slowest first
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=PROJECT_DIR, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr.strip().splitlines()[-1]}")
+
+    total = 0
+    children = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package (indented by nesting depth)
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        name = name[1:]
+        depth = (len(name) - len(name.lstrip(' '))) // 2
+        if depth == 0:
+            # Interpreter startup modules are also reported at depth 0, keep only our module
+            if name == module:
+                total = int(cumulative)
+                break
+            children = []
+        elif depth == 1:
+            children.append((int(cumulative), name.strip()))
+
+    return total, sorted(children, reverse=True)
+
+def measure_command(args, repeats=3):
+    """Best wall time in seconds of running a command in a fresh interpreter"""
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, cwd=PROJECT_DIR, capture_output=True)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def run_import_time(args):
+    print("\n=== Import Time Report (python -X importtime) ===")
+    failed = False
+    for module in args.modules:
+        try:
+            total, top = measure_import_time(module)
+        except RuntimeError as e:
+            print(f"{module:28s}  ERROR  {e}")
+            failed = True
+            continue
+
+        over = args.max_ms is not None and total / 1000 > args.max_ms
+        failed |= over
+        print(f"{module:28s} {total / 1000:8.1f} ms{'  OVER BUDGET' if over else ''}")
+        for cumulative, name in top[:args.top]:
+            print(f"    {name:24s} {cumulative / 1000:8.1f} ms")
+
+    help_time = measure_command(['split_stems.py', '--help'])
+    over = args.max_ms is not None and help_time * 1000 > args.max_ms
+    failed |= over
+    print(f"\n{'split_stems.py --help':28s} {help_time * 1000:8.1f} ms wall{'  OVER BUDGET' if over else ''}")
+    return not failed
+
+def make_synthetic_library(folder, num_tracks, seconds=30, sr=22050):
+    """Write click tracks at random tempos, a stand-in for a real library"""
+    import numpy as np
+    import soundfile as sf
+
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(num_tracks):
+        bpm = rng.uniform(80, 160)
+        y = 0.01 * rng.standard_normal(seconds * sr).astype(np.float32)
+        click = np.hanning(256).astype(np.float32)
+        for beat in np.arange(0, seconds, 60.0 / bpm):
+            start = int(beat * sr)
+            y[start:start + len(click)] += click[:len(y) - start]
+        path = os.path.join(folder, f"synthetic_{i:04d}.wav")
+        sf.write(path, y, sr)
+        paths.append(path)
+    return paths
+
+def run_bpm_batch(args):
+    import tempfile
+    import librosa
+    from deeprhythm import DeepRhythmPredictor
+    from step1_BPMAnalysis import bpm_worker_pool, detect_bpm_batch
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.folder:
+            paths = sorted(os.path.join(args.folder, f) for f in os.listdir(args.folder)
+                           if f.lower().endswith(('.mp3', '.wav', '.m4a', '.flac')))[:args.limit]
+        else:
+            print(f"Writing {args.synthetic} synthetic tracks...")
+            paths = make_synthetic_library(tmp_dir, args.synthetic)
+
+        predictor = DeepRhythmPredictor()
+        print(f"\n=== BPM Throughput ({len(paths)} tracks) ===")
+
+        # Today's path: decode and predict one track at a time
+        start = time.perf_counter()
+        loop_results = []
+        for path in paths:
+            y, sr = librosa.load(path)
+            loop_results.append(predictor.predict_from_audio(y, sr, include_confidence=True))
+        loop_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        batch_results = detect_bpm_batch(paths, workers=args.workers, batch_size=args.batch_size,
+                                         predictor=predictor)
+        batch_time = time.perf_counter() - start
+
+        # Headless mode: one call per group of files over a pool started once for the run
+        start = time.perf_counter()
+        with bpm_worker_pool(args.workers) as pool:
+            for group_start in range(0, len(paths), args.group):
+                detect_bpm_batch(paths[group_start:group_start + args.group], batch_size=args.batch_size,
+                                 predictor=predictor, executor=pool)
+        group_time = time.perf_counter() - start
+
+    agree = sum(1 for a, b in zip(loop_results, batch_results) if b and abs(a[0] - b[0]) < 0.5)
+    print(f"{'per-file loop':16s} {loop_time:8.2f} s  {len(paths) / loop_time:7.2f} tracks/s")
+    print(f"{'batched':16s} {batch_time:8.2f} s  {len(paths) / batch_time:7.2f} tracks/s")
+    print(f"{f'groups of {args.group}':16s} {group_time:8.2f} s  {len(paths) / group_time:7.2f} tracks/s")
+    print(f"Speedup: {loop_time / batch_time:.2f}x, BPM agreement: {agree}/{len(paths)}")
+    return agree == len(paths)
+
+def make_format_samples(folder, seconds, sr=44100):
+    """Write the same stereo test signal in every format this machine can encode"""
+    import shutil
+    import numpy as np
+    import soundfile as sf
+
+    rng = np.random.default_rng(0)
+    t = np.arange(seconds * sr) / sr
+    y = np.stack([0.3 * np.sin(2 * np.pi * 220 * t), 0.3 * np.sin(2 * np.pi * 330 * t)], axis=1)
+    y = (y + 0.05 * rng.standard_normal(y.shape)).astype(np.float32)
+
+    wav_path = os.path.join(folder, 'sample.wav')
+    sf.write(wav_path, y, sr)
+    paths = [wav_path]
+    flac_path = os.path.join(folder, 'sample.flac')
+    sf.write(flac_path, y, sr)
+    paths.append(flac_path)
+
+    if shutil.which('ffmpeg'):
+        for extension in ('.mp3', '.m4a'):
+            path = os.path.join(folder, f"sample{extension}")
+            subprocess.run(['ffmpeg', '-nostdin', '-v', 'error', '-y', '-i', wav_path, path], check=True)
+            paths.append(path)
+    else:
+        print("ffmpeg not found, skipping mp3/m4a (and decode() falls back to librosa for them)")
+    return paths
+
+def run_decode(args):
+    import tempfile
+    import librosa
+    from audio_decoder import decode
+
+    def best_time(load):
+        best = None
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            y, sr = load()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best, len(y) / sr
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.files:
+            paths = args.files
+        else:
+            print(f"Writing {args.seconds} s test files...")
+            paths = make_format_samples(tmp_dir, args.seconds)
+
+        print(f"\n=== Decode Throughput (mono, 22050 Hz, x realtime, best of {args.repeats}) ===")
+        print(f"{'file':20s} {'librosa.load':>14s} {'decode':>10s} {'excerpt':>10s}")
+        for path in paths:
+            librosa_time, seconds = best_time(lambda: librosa.load(path))
+            decode_time, _ = best_time(lambda: decode(path))
+            # Analysis-style excerpt from the middle of the track
+            excerpt_time, excerpt_seconds = best_time(
+                lambda: decode(path, offset=seconds / 2, duration=args.excerpt))
+            print(f"{os.path.basename(path):20s} {seconds / librosa_time:13.1f}x {seconds / decode_time:9.1f}x "
+                  f"{excerpt_seconds / excerpt_time:9.1f}x")
+    return True
+
+def run_separation(args):
+    import torch
+    import numpy as np
+    import soundfile as sf
+    import tempfile
+    from pathlib import Path
+    from demucs.apply import apply_model
+    from demucs.separate import load_track
+    import onnx_backend
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    onnx_backend.set_threads(args.threads)
+    tolerance = args.tolerance if args.tolerance is not None else onnx_backend.PARITY_TOLERANCE
+    drumsep_repo = os.path.join(PROJECT_DIR, 'step3_0_Seperation_Models', 'drumsep', 'model')
+    models = [('htdemucs', args.repo), ('49469ca8', args.repo or drumsep_repo)]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = args.file
+        if path is None:
+            path = os.path.join(tmp_dir, 'sample.wav')
+            sr = 44100
+            t = np.arange(args.seconds * sr) / sr
+            rng = np.random.default_rng(0)
+            y = 0.2 * np.sin(2 * np.pi * 110 * t) + 0.05 * rng.standard_normal(len(t))
+            sf.write(path, np.stack([y, y], axis=1).astype(np.float32), sr)
+
+        print(f"\n=== Separation Backends ({torch.get_num_threads()} threads, RTF = processing time / audio length) ===")
+        print(f"{'model':10s} {'torch RTF':>10s} {'onnx RTF':>10s} {'speedup':>8s} {'chunk err':>10s} {'track err':>10s}")
+        all_ok = True
+        for name, repo in models:
+            if repo and not os.path.isdir(repo):
+                print(f"{name:10s} model repo not found at {repo}, skipping")
+                continue
+
+            # Parity on one chunk also exports the graphs, so the timing below excludes the export
+            chunk_error = max(onnx_backend.check_parity(name, repo))
+
+            results = {}
+            for backend, model in (('torch', onnx_backend.load_model(name, repo)),
+                                   ('onnx', onnx_backend.onnx_model(name, repo))):
+                wav = load_track(Path(path), model.audio_channels, model.samplerate)
+                start = time.perf_counter()
+                # No random shift, so both backends see identical chunks
+                with torch.no_grad():
+                    out = apply_model(model, wav[None], device='cpu', shifts=0, split=True, overlap=0.25)
+                results[backend] = (time.perf_counter() - start, out)
+            seconds = wav.shape[-1] / model.samplerate
+
+            torch_time, torch_out = results['torch']
+            onnx_time, onnx_out = results['onnx']
+            track_error = (torch_out - onnx_out).abs().max().item()
+            ok = chunk_error <= tolerance and track_error <= tolerance
+            all_ok &= ok
+            print(f"{name:10s} {torch_time / seconds:10.3f} {onnx_time / seconds:10.3f} "
+                  f"{torch_time / onnx_time:7.2f}x {chunk_error:10.2e} {track_error:10.2e}"
+                  f"{'' if ok else '  PARITY FAILED'}")
+    return all_ok
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Neural Stem Slicer benchmarks")
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    import_parser = subparsers.add_parser('import-time', help="Startup import cost of the entry points")
+    import_parser.add_argument('modules', nargs='*', default=ENTRY_MODULES)
+    import_parser.add_argument('--top', type=int, default=5, help="Slowest imports to list per module")
+    import_parser.add_argument('--max-ms', type=float, default=None,
+                               help="Fail if any module or the --help run exceeds this many ms")
+    import_parser.set_defaults(func=run_import_time)
+
+    bpm_parser = subparsers.add_parser('bpm-batch', help="Per-file vs batched DeepRhythm BPM throughput")
+    bpm_parser.add_argument('folder', nargs='?', default=None, help="Folder of audio files (default: synthetic tracks)")
+    bpm_parser.add_argument('--limit', type=int, default=1000, help="Maximum number of files from the folder")
+    bpm_parser.add_argument('--synthetic', type=int, default=1000, help="Number of synthetic tracks without a folder")
+    bpm_parser.add_argument('--workers', type=int, default=None, help="Feature worker processes (default: CPU count)")
+    bpm_parser.add_argument('--batch-size', type=int, default=128, help="Clips per model forward pass")
+    bpm_parser.add_argument('--group', type=int, default=8,
+                            help="Files per call over one shared worker pool, as in headless mode")
+    bpm_parser.set_defaults(func=run_bpm_batch)
+
+    decode_parser = subparsers.add_parser('decode', help="Decode throughput per format, librosa.load vs audio_decoder")
+    decode_parser.add_argument('files', nargs='*', help="Audio files to decode (default: one test file per format)")
+    decode_parser.add_argument('--seconds', type=int, default=240, help="Length of the generated test files")
+    decode_parser.add_argument('--excerpt', type=float, default=30, help="Length of the windowed excerpt in seconds")
+    decode_parser.add_argument('--repeats', type=int, default=3)
+    decode_parser.set_defaults(func=run_decode)
+
+    separation_parser = subparsers.add_parser('separation',
+                                              help="PyTorch vs ONNX Runtime real-time factor and output parity")
+    separation_parser.add_argument('file', nargs='?', default=None, help="Audio file (default: generated test tone)")
+    separation_parser.add_argument('--seconds', type=int, default=30, help="Length of the generated test file")
+    separation_parser.add_argument('--threads', type=int, default=0,
+                                   help="Threads for both backends (default: PyTorch's default)")
+    separation_parser.add_argument('--tolerance', type=float, default=None,
+                                   help="Maximum absolute output difference (default: onnx_backend.PARITY_TOLERANCE)")
+    separation_parser.add_argument('--repo', default=None,
+                                   help="Folder with local copies of both models (.th/.yaml) for offline machines")
+    separation_parser.set_defaults(func=run_separation)
+
+    args = parser.parse_args()
+    sys.exit(0 if args.func(args) else 1)
\ No newline at end of file
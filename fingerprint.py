@@ -0,0 +1,135 @@
+import os
+import json
+import time
+import sqlite3
+import numpy as np
+
+# Chroma frames are pooled to roughly 2 codes per second, enough to tell songs apart
+# while staying identical across mp3/m4a/wav/flac encodings of the same master
+HOP_LENGTH = 2048
+POOL_FRAMES = 5
+MATCH_THRESHOLD = 0.85
+MAX_OFFSET_CODES = 16  # ~8 seconds of leading silence/trim difference
+MIN_OVERLAP = 0.8
+
+def compute_fingerprint(y, sr):
+    """
+    Compact chroma fingerprint of a mono buffer
+    Each code holds 12 bits, one per pitch class: whether it is stronger than the next
+    pitch class up. These comparisons survive gain changes and lossy encoding, and unlike
+    frame-to-frame differences they barely change when a copy is trimmed by a fraction of a code
+    Returns a uint16 array with one code per pooled frame
+    """
+    import librosa
+
+    chroma = librosa.feature.chroma_stft(y=y, sr=sr, hop_length=HOP_LENGTH)
+
+    # Average pool over time
+    n_pooled = chroma.shape[1] // POOL_FRAMES
+    if n_pooled < 2:
+        return np.zeros(0, dtype=np.uint16)
+    pooled = chroma[:, :n_pooled * POOL_FRAMES].reshape(12, n_pooled, POOL_FRAMES).mean(axis=2)
+
+    bits = pooled > np.roll(pooled, -1, axis=0)
+    weights = (1 << np.arange(12)).reshape(12, 1)
+    return (bits * weights).sum(axis=0).astype(np.uint16)
+
+def match_score(fp_a, fp_b, max_offset=MAX_OFFSET_CODES):
+    """
+    Fraction of matching fingerprint bits at the best alignment of two fingerprints
+    Unrelated tracks score around 0.5, re-encodes of the same audio close to 1.0
+    """
+    shorter = min(len(fp_a), len(fp_b))
+    if shorter == 0:
+        return 0.0
+
+    best = 0.0
+    for offset in range(-max_offset, max_offset + 1):
+        a = fp_a[max(offset, 0):]
+        b = fp_b[max(-offset, 0):]
+        n = min(len(a), len(b))
+        if n < shorter * MIN_OVERLAP:
+            continue
+        diff = np.bitwise_xor(a[:n], b[:n])
+        errors = np.unpackbits(diff.view(np.uint8)).sum()
+        best = max(best, 1.0 - errors / (n * 12))
+    return float(best)
+
+class FingerprintIndex:
+    """
+    Local SQLite index of processed tracks, their fingerprints and output paths
+    A new connection is opened per call so worker threads can share one index
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self.connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS tracks (
+                    id INTEGER PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    duration REAL NOT NULL,
+                    fingerprint BLOB NOT NULL,
+                    stems TEXT NOT NULL,
+                    segments TEXT NOT NULL,
+                    created REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS tracks_duration ON tracks (duration)")
+
+    def connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def find_match(self, fingerprint, duration, threshold=MATCH_THRESHOLD):
+        """
+        Find an already processed track that sounds the same
+        Only tracks of similar duration are compared. Entries whose outputs were deleted are dropped
+        Returns (match dict or None, best score)
+        """
+        tolerance = max(5.0, duration * 0.05)
+        with self.connect() as conn:
+            rows = conn.execute(
+                "SELECT id, path, duration, fingerprint, stems, segments FROM tracks "
+                "WHERE duration BETWEEN ? AND ?",
+                (duration - tolerance, duration + tolerance)
+            ).fetchall()
+
+        best_match, best_score = None, 0.0
+        for row_id, path, row_duration, blob, stems, segments in rows:
+            score = match_score(fingerprint, np.frombuffer(blob, dtype=np.uint16))
+            if score > best_score:
+                best_score = score
+                best_match = {
+                    'id': row_id,
+                    'path': path,
+                    'duration': row_duration,
+                    'stems': json.loads(stems),
+                    'segments': json.loads(segments)
+                }
+
+        if best_match is None or best_score < threshold:
+            return None, best_score
+
+        if not all(os.path.exists(p) for p in best_match['stems']):
+            print(f"Outputs of {best_match['path']} are missing, removing it from the index")
+            self.remove(best_match['id'])
+            return None, best_score
+
+        return best_match, best_score
+
+    def add(self, path, duration, fingerprint, stems, segments):
+        with self.connect() as conn:
+            conn.execute(
+                "INSERT INTO tracks (path, duration, fingerprint, stems, segments, created) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (path, float(duration), np.asarray(fingerprint, dtype=np.uint16).tobytes(),
+                 json.dumps(stems), json.dumps(segments), time.time())
+            )
+
+    def remove(self, row_id):
+        with self.connect() as conn:
+            conn.execute("DELETE FROM tracks WHERE id = ?", (row_id,))
+
+def default_index_path():
+    return os.path.join(os.getcwd(), 'output', 'fingerprints.db')
\ No newline at end of file
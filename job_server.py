@@ -0,0 +1,364 @@
+import os
+import json
+import math
+import time
+import uuid
+import queue
+import argparse
+import threading
+import ipaddress
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from pipeline import BACKENDS, CAMELOT_PATTERN, analyze_track, plan_targets, process_track
+from memory_governor import format_size, parse_size
+
+TERMINAL_STATES = ('done', 'failed')
+
+class Job:
+    """A single separation request and the progress events it has produced"""
+
+    def __init__(self, file_path, manual_bpm=None, manual_key=None, chop=True, on_duplicate='reuse',
+                 targets=None, backend='torch'):
+        self.id = uuid.uuid4().hex[:12]
+        self.file_path = file_path
+        self.manual_bpm = manual_bpm
+        self.manual_key = manual_key
+        self.chop = chop
+        self.on_duplicate = on_duplicate
+        self.targets = targets
+        self.backend = backend
+        self.fingerprint = None
+        self.memory_estimate = None
+        self.state = 'queued'
+        self.created = time.time()
+        self.analysis = None
+        self.result = None
+        self.error = None
+        self.events = []
+        self.cond = threading.Condition()
+        self.add_event(progress=0, status="Queued")
+
+    def add_event(self, progress=None, status=None, state=None):
+        with self.cond:
+            if state:
+                self.state = state
+            self.events.append({
+                'seq': len(self.events),
+                'time': time.time(),
+                'state': self.state,
+                'progress': progress,
+                'status': status
+            })
+            self.cond.notify_all()
+
+    def wait_for_events(self, since, timeout=15.0):
+        """Block until events newer than `since` exist, the job finished or timeout expired"""
+        with self.cond:
+            self.cond.wait_for(lambda: len(self.events) > since or self.state in TERMINAL_STATES,
+                               timeout=timeout)
+            return self.events[since:], self.state in TERMINAL_STATES
+
+    def to_dict(self):
+        with self.cond:
+            return {
+                'id': self.id,
+                'file': self.file_path,
+                'manual_bpm': self.manual_bpm,
+                'manual_key': self.manual_key,
+                'state': self.state,
+                'created': self.created,
+                'on_duplicate': self.on_duplicate,
+                'targets': self.targets,
+                'backend': self.backend,
+                'memory_estimate': self.memory_estimate,
+                'analysis': self.analysis,
+                'result': self.result,
+                'error': self.error,
+                'last_event': self.events[-1] if self.events else None
+            }
+
+class JobManager:
+    """
+    Queue of separation jobs served by a pool of worker threads
+    Each worker loads its DeepRhythm model once and keeps it warm between jobs, as well as the
+    separation models of jobs with backend 'onnx' (torch jobs run the demucs/drumsep CLIs, which
+    load their models per job)
+    With several workers, jobs only start while their estimated peak memory fits the budget
+    """
+
+    def __init__(self, output_root, num_workers=1, index_path=None, memory_budget=None):
+        from memory_governor import MemoryGovernor
+        self.output_root = os.path.abspath(output_root)
+        self.governor = MemoryGovernor(memory_budget, os.path.join(self.output_root, 'memory_log.jsonl'))
+        self.index_path = index_path or os.path.join(self.output_root, 'fingerprints.db')
+        self.segment_index_path = os.path.join(self.output_root, 'segments.db')
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.pending = queue.Queue()
+        self.workers = []
+        for i in range(num_workers):
+            # Loaded here rather than in the thread: if a model or index cannot be opened the
+            # server fails to start, instead of accepting jobs no worker will ever pick up
+            try:
+                resources = self._load_worker_resources()
+            except Exception as e:
+                raise RuntimeError(f"Could not start job worker {i}: {e}") from e
+            worker = threading.Thread(target=self._worker_loop, args=resources,
+                                      name=f"job-worker-{i}", daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, file_path, manual_bpm=None, manual_key=None, chop=True, on_duplicate='reuse',
+               targets=None, backend='torch'):
+        job = Job(file_path, manual_bpm, manual_key, chop, on_duplicate, targets, backend)
+        with self.lock:
+            self.jobs[job.id] = job
+        self.pending.put(job)
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list(self):
+        with self.lock:
+            return list(self.jobs.values())
+
+    def _load_worker_resources(self):
+        """The warm DeepRhythm model, the indexes and the (initially empty) separation model cache of one worker"""
+        from deeprhythm import DeepRhythmPredictor
+        from fingerprint import FingerprintIndex
+        from segment_index import SegmentIndex
+        return DeepRhythmPredictor(), FingerprintIndex(self.index_path), SegmentIndex(self.segment_index_path), {}
+
+    def _worker_loop(self, predictor, dedupe_index, segment_index, model_cache):
+        from memory_governor import estimate_file
+        while True:
+            job = self.pending.get()
+            try:
+                job.memory_estimate = estimate_file(job.file_path, job.targets, job.chop)
+                with self.governor.admit(job.file_path, job.memory_estimate,
+                                         on_wait=lambda message: job.add_event(status=message)):
+                    self._run(job, predictor, dedupe_index, segment_index, model_cache)
+            except Exception as e:
+                job.error = str(e)
+                job.add_event(status=f"Error: {e}", state='failed')
+            finally:
+                self.pending.task_done()
+
+    def _run(self, job, predictor, dedupe_index, segment_index, model_cache):
+        job.add_event(progress=0, status="Analyzing BPM and key...", state='analyzing')
+        analysis = analyze_track(job.file_path, predictor=predictor,
+                                 peaks_dir=os.path.join(self.output_root, 'analysis'))
+        # The fingerprint is binary, keep it out of the JSON job description
+        job.fingerprint = analysis.pop('fingerprint')
+        job.analysis = analysis
+
+        bpm = job.manual_bpm if job.manual_bpm is not None else job.analysis['bpm']
+        camelot_key = job.manual_key if job.manual_key else job.analysis['camelot']
+
+        # Every job gets its own folder so chopping only sees this job's stems
+        output_folder = os.path.join(self.output_root, job.id)
+        job.add_event(progress=0, status="Starting stem separation...", state='separating')
+
+        def on_progress(progress, status_message=None):
+            job.add_event(progress=progress, status=status_message)
+
+        job.result = process_track(job.file_path, camelot_key, bpm, output_folder,
+                                   progress_callback=on_progress, chop=job.chop,
+                                   fingerprint=job.fingerprint, duration=analysis['duration'],
+                                   dedupe_index=dedupe_index if job.on_duplicate != 'off' else None,
+                                   on_duplicate=job.on_duplicate,
+                                   targets=job.targets,
+                                   backend=job.backend,
+                                   segment_index=segment_index,
+                                   model_cache=model_cache)
+        if job.result is None:
+            job.error = job.events[-1]['status']
+            job.add_event(status=job.error, state='failed')
+        else:
+            job.add_event(progress=100, status=f"Completed processing {os.path.basename(job.file_path)}",
+                          state='done')
+
+def is_loopback(host):
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+def parse_job_request(payload):
+    """
+    Validate a job submission body
+    Returns (file_path, manual_bpm, manual_key, chop, on_duplicate, targets, backend) or raises ValueError
+    """
+    if not isinstance(payload, dict):
+        raise ValueError("Request body must be a JSON object")
+
+    file_path = payload.get('path')
+    if not file_path or not os.path.isfile(file_path):
+        raise ValueError(f"Input file not found: {file_path}")
+    if not file_path.lower().endswith(('.mp3', '.wav', '.m4a', '.flac')):
+        raise ValueError(f"Unsupported audio format: {file_path}")
+
+    manual_bpm = payload.get('manual_bpm')
+    if manual_bpm not in (None, ''):
+        try:
+            manual_bpm = float(manual_bpm)
+        except (TypeError, ValueError):
+            raise ValueError(f"manual_bpm must be a number, got {manual_bpm!r}")
+        # json.loads accepts NaN and Infinity, which would end up in every output file name
+        if not math.isfinite(manual_bpm) or manual_bpm <= 0:
+            raise ValueError(f"manual_bpm must be a positive number, got {manual_bpm!r}")
+    else:
+        manual_bpm = None
+
+    manual_key = payload.get('manual_key') or None
+    if manual_key is not None and not CAMELOT_PATTERN.match(str(manual_key)):
+        raise ValueError(f"manual_key must be a Camelot key like '8A', got {manual_key!r}")
+
+    on_duplicate = payload.get('on_duplicate', 'reuse')
+    if on_duplicate not in ('reuse', 'skip', 'off'):
+        raise ValueError(f"on_duplicate must be 'reuse', 'skip' or 'off', got {on_duplicate!r}")
+
+    targets = payload.get('targets')
+    if targets is not None:
+        if not isinstance(targets, list):
+            raise ValueError("targets must be a list of stem names")
+        plan_targets(targets)
+
+    backend = payload.get('backend', 'torch')
+    if backend not in BACKENDS:
+        raise ValueError(f"backend must be one of {', '.join(BACKENDS)}, got {backend!r}")
+    if backend == 'onnx':
+        from onnx_backend import available
+        if not available():
+            raise ValueError("backend 'onnx' needs onnxruntime installed on the server")
+
+    return (os.path.abspath(file_path), manual_bpm, manual_key, bool(payload.get('chop', True)),
+            on_duplicate, targets, backend)
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    """
+    POST /jobs                 submit {"path", "manual_bpm", "manual_key", "chop", "on_duplicate", "targets",
+                               "backend"}
+    GET  /jobs                 list all jobs
+    GET  /jobs/<id>            job state, analysis and resulting stem/segment paths
+    GET  /jobs/<id>/events     progress as a server-sent event stream (?since=<seq>)
+    """
+    manager = None
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def reject_remote(self):
+        if not is_loopback(self.client_address[0]):
+            self.send_json(403, {'error': 'Only local clients are allowed'})
+            return True
+        return False
+
+    def do_POST(self):
+        if self.reject_remote():
+            return
+        if urlparse(self.path).path.rstrip('/') != '/jobs':
+            self.send_json(404, {'error': 'Not found'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            payload = json.loads(self.rfile.read(length) or b'{}')
+            file_path, manual_bpm, manual_key, chop, on_duplicate, targets, backend = parse_job_request(payload)
+        except (ValueError, json.JSONDecodeError) as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        job = self.manager.submit(file_path, manual_bpm, manual_key, chop, on_duplicate, targets, backend)
+        self.send_json(202, {'id': job.id, 'state': job.state})
+
+    def do_GET(self):
+        if self.reject_remote():
+            return
+        url = urlparse(self.path)
+        parts = [p for p in url.path.split('/') if p]
+
+        if parts == ['jobs']:
+            self.send_json(200, [job.to_dict() for job in self.manager.list()])
+            return
+        if len(parts) in (2, 3) and parts[0] == 'jobs':
+            job = self.manager.get(parts[1])
+            if job is None:
+                self.send_json(404, {'error': f"Unknown job {parts[1]}"})
+            elif len(parts) == 2:
+                self.send_json(200, job.to_dict())
+            elif parts[2] == 'events':
+                since = parse_qs(url.query).get('since', ['0'])[0]
+                if not (since.isascii() and since.isdigit()):
+                    self.send_json(400, {'error': f"Invalid since: {since!r}, expected an event sequence number >= 0"})
+                    return
+                self.stream_events(job, int(since))
+            else:
+                self.send_json(404, {'error': 'Not found'})
+            return
+        self.send_json(404, {'error': 'Not found'})
+
+    def stream_events(self, job, since):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        try:
+            while True:
+                events, finished = job.wait_for_events(since)
+                for event in events:
+                    self.wfile.write(f"id: {event['seq']}\ndata: {json.dumps(event)}\n\n".encode('utf-8'))
+                since += len(events)
+                if not events:
+                    # Keep idle connections open through long separations
+                    self.wfile.write(b": keep-alive\n\n")
+                self.wfile.flush()
+                if finished and not events:
+                    break
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+def run_server(host='127.0.0.1', port=8765, output_root=None, num_workers=1, memory_budget=None):
+    if not is_loopback(host):
+        raise ValueError(f"Job server only binds to localhost, got {host}")
+    if output_root is None:
+        output_root = os.path.join(os.getcwd(), 'output', 'jobs')
+
+    JobRequestHandler.manager = JobManager(output_root, num_workers, memory_budget=memory_budget)
+    server = ThreadingHTTPServer((host, port), JobRequestHandler)
+    server.daemon_threads = True
+
+    print(f"Job server listening on http://{host}:{port} ({num_workers} worker(s))")
+    print(f"Output folder: {output_root}")
+    print(f"Memory budget: {format_size(JobRequestHandler.manager.governor.budget)}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nShutting down job server...")
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local HTTP API for submitting and monitoring stem separation jobs")
+    parser.add_argument('--host', default='127.0.0.1', help="Loopback address to bind (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8765, help="Port to listen on (default: 8765)")
+    parser.add_argument('--output', default=None, help="Folder for job outputs (default: ./output/jobs)")
+    parser.add_argument('--workers', type=int, default=1, help="Number of worker threads (default: 1)")
+    parser.add_argument('--memory-budget', type=parse_size, default=None,
+                        help="RAM available to concurrent jobs, e.g. 12G (default: 75%% of physical memory)")
+    parser.add_argument('--onnx-threads', type=int, default=0,
+                        help="ONNX Runtime intra-op threads for jobs with backend 'onnx' (default: one per core)")
+    args = parser.parse_args()
+
+    if args.onnx_threads:
+        from onnx_backend import set_threads
+        set_threads(args.onnx_threads)
+
+    run_server(args.host, args.port, args.output, args.workers, args.memory_budget)
\ No newline at end of file
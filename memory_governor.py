@@ -0,0 +1,238 @@
+import os
+import json
+import time
+import argparse
+import threading
+from contextlib import contextmanager
+
+MB = 1024 ** 2
+GB = 1024 ** 3
+
+# Rough peak memory of each stage: (fixed cost, bytes per second of 44.1 kHz stereo audio).
+# The fixed part covers the models and interpreters of the Demucs/drumsep subprocesses,
+# the per-second part the full-length buffers and tensors. Stages run one after another,
+# so a job's peak is that of its largest stage. Calibrate with --report on memory_log.jsonl
+STAGE_COSTS = {
+    'analysis': (300 * MB, 0.6 * MB),   # 22.05 kHz mono decode, CQT chroma, DeepRhythm HCQM
+    'demucs': (1500 * MB, 4.0 * MB),    # input + 4 source tensors, overlap-add buffers
+    'drumsep': (1200 * MB, 3.0 * MB),   # same as demucs on the drum stem, plus the loaded stem
+    'chop': (50 * MB, 1.8 * MB)         # float32 stem, one segment's STFT for the index features
+}
+REFERENCE_RATE = 44100 * 2
+SAMPLE_INTERVAL = 0.25
+
+def job_stages(targets=None, chop=True):
+    """Stages a job runs for the given stem targets (see pipeline.plan_targets)"""
+    from pipeline import plan_targets
+
+    plan = plan_targets(targets)
+    stages = ['analysis', 'demucs']
+    if plan['drum_parts']:
+        stages.append('drumsep')
+    if chop:
+        stages.append('chop')
+    return stages
+
+def estimate_job_peak_bytes(duration, sr=44100, channels=2, stages=tuple(STAGE_COSTS)):
+    """Estimated peak memory of one job in bytes, from the track's length and format"""
+    scale = duration * sr * channels / REFERENCE_RATE
+    return int(max(STAGE_COSTS[stage][0] + STAGE_COSTS[stage][1] * scale for stage in stages))
+
+def estimate_file(file_path, targets=None, chop=True):
+    """Estimate a job's peak memory from the file header, without decoding the audio"""
+    from audio_decoder import audio_info
+
+    duration, sr, channels = audio_info(file_path)
+    # Demucs works at 44.1 kHz stereo whatever the input is
+    return estimate_job_peak_bytes(duration, max(sr, 44100), max(channels, 2), job_stages(targets, chop))
+
+def parse_size(text):
+    """Parse a memory size like '8G', '512M' or a plain number of bytes"""
+    text = str(text).strip().upper().rstrip('B')
+    units = {'K': 1024, 'M': MB, 'G': GB, 'T': 1024 * GB}
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(float(text))
+
+def total_memory():
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+def format_size(num_bytes):
+    return f"{num_bytes / GB:.2f} GB"
+
+def current_tree_rss():
+    """Resident memory of this process and all its children (Demucs, drumsep), None without psutil"""
+    try:
+        import psutil
+    except ImportError:
+        return None
+    process = psutil.Process()
+    total = process.memory_info().rss
+    for child in process.children(recursive=True):
+        try:
+            total += child.memory_info().rss
+        except psutil.Error:
+            pass
+    return total
+
+def high_water_rss():
+    """Largest resident size of this process or any finished child so far (resource fallback)"""
+    import sys
+    import resource
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    unit = 1 if sys.platform == 'darwin' else 1024
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * unit
+
+class PeakSampler:
+    """
+    Samples the process tree's memory in a background thread while a job runs
+    Without psutil only the lifetime high-water mark is available: the job's peak is then
+    known only if it raised the mark, and measured against the mark at job start
+    """
+
+    def __init__(self):
+        self.method = 'psutil' if current_tree_rss() is not None else 'maxrss'
+        self.baseline = current_tree_rss() if self.method == 'psutil' else high_water_rss()
+        self.peak = self.baseline
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.method == 'psutil':
+            self._thread = threading.Thread(target=self._loop, daemon=True)
+            self._thread.start()
+        return self
+
+    def _loop(self):
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            rss = current_tree_rss()
+            if rss > self.peak:
+                self.peak = rss
+
+    def stop(self):
+        """Returns the peak in bytes, None if it could not be measured"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        else:
+            mark = high_water_rss()
+            # An unchanged mark only repeats the peak of an earlier job
+            self.peak = mark if mark > self.baseline else None
+        return self.peak
+
+class MemoryGovernor:
+    """
+    Admits jobs only while the sum of their estimated peaks fits the memory budget
+    Jobs are admitted in arrival order; a job larger than the whole budget runs alone.
+    Estimated and measured peaks of every job are appended to log_path as JSON lines
+    """
+
+    def __init__(self, budget=None, log_path=None):
+        self.budget = budget or int(total_memory() * 0.75)
+        self.log_path = log_path
+        self.in_use = 0
+        self.running = 0
+        self.cond = threading.Condition()
+        self.waiting = []
+        self.log_lock = threading.Lock()
+
+    def _fits(self, ticket, estimate):
+        if self.waiting[0] is not ticket:
+            return False
+        return self.running == 0 or self.in_use + estimate <= self.budget
+
+    @contextmanager
+    def admit(self, name, estimate, on_wait=None):
+        """
+        Block until the job fits the budget, then run the with-block as an admitted job
+        on_wait(status_message) is called once if the job has to wait
+        """
+        ticket = object()
+        wait_start = time.time()
+        with self.cond:
+            self.waiting.append(ticket)
+            if not self._fits(ticket, estimate):
+                message = (f"Waiting for memory: needs ~{format_size(estimate)}, "
+                           f"{format_size(self.in_use)} of {format_size(self.budget)} in use")
+                print(f"{os.path.basename(name)}: {message}")
+                if on_wait:
+                    on_wait(message)
+                self.cond.wait_for(lambda: self._fits(ticket, estimate))
+            self.waiting.pop(0)
+            self.in_use += estimate
+            self.running += 1
+            concurrent = self.running
+            # The next job in line may fit alongside this one
+            self.cond.notify_all()
+
+        sampler = PeakSampler().start()
+        try:
+            yield
+        finally:
+            peak = sampler.stop()
+            with self.cond:
+                concurrent = max(concurrent, self.running)
+                self.in_use -= estimate
+                self.running -= 1
+                self.cond.notify_all()
+            self._log({
+                'time': time.time(),
+                'job': name,
+                'estimate': estimate,
+                'measured_peak': peak,
+                'baseline': sampler.baseline,
+                'method': sampler.method,
+                'concurrent_jobs': concurrent,
+                'wait_seconds': round(time.time() - wait_start, 3)
+            })
+
+    def _log(self, record):
+        measured = record['measured_peak']
+        print(f"Memory: estimated {format_size(record['estimate'])}, measured peak "
+              f"{format_size(measured) if measured is not None else 'unknown'} ({record['method']})")
+        if not self.log_path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.log_path)), exist_ok=True)
+        with self.log_lock, open(self.log_path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+def default_log_path():
+    return os.path.join(os.getcwd(), 'output', 'memory_log.jsonl')
+
+def print_report(log_path):
+    """Compare estimated and measured peaks of the jobs that ran alone"""
+    with open(log_path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    solo = [r for r in records if r['concurrent_jobs'] == 1 and r['estimate'] > 0
+            and r['measured_peak'] is not None]
+    if not solo:
+        print("No measured jobs that ran alone in the log, nothing to calibrate against")
+        return
+
+    ratios = []
+    for record in solo:
+        measured = record['measured_peak'] - record['baseline']
+        ratios.append(measured / record['estimate'])
+        print(f"{os.path.basename(record['job'])[:40]:40s} estimated {format_size(record['estimate'])}  "
+              f"measured {format_size(measured)}  ratio {ratios[-1]:.2f}")
+    ratios.sort()
+    print(f"\n{len(solo)} solo job(s) of {len(records)}, median measured/estimated ratio "
+          f"{ratios[len(ratios) // 2]:.2f}, max {ratios[-1]:.2f}")
+    print("Scale STAGE_COSTS by the max ratio to stay on the safe side")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Estimate job memory or report estimated vs measured peaks")
+    parser.add_argument('files', nargs='*', help="Audio files to estimate")
+    parser.add_argument('--targets', default=None, help="Comma separated stems to produce")
+    parser.add_argument('--no-chop', action='store_true', help="Estimate without Module 3 chopping")
+    parser.add_argument('--report', nargs='?', const=default_log_path(), default=None,
+                        help="Summarize a memory log (default: output/memory_log.jsonl)")
+    args = parser.parse_args()
+
+    if args.report:
+        print_report(args.report)
+    targets = args.targets.split(',') if args.targets else None
+    for file_path in args.files:
+        print(f"{format_size(estimate_file(file_path, targets, not args.no_chop))}  {file_path}")
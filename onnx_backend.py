@@ -0,0 +1,308 @@
+import os
+import math
+import threading
+from pathlib import Path
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(PROJECT_DIR, 'step3_0_Seperation_Models', 'onnx')
+OPSET = 17
+PARITY_TOLERANCE = 1e-3
+
+# ONNX Runtime thread pools; 0 lets ORT use one intra-op thread per physical core
+session_threads = {'intra_op': 0, 'inter_op': 0}
+_sessions = {}
+_classes = {}
+_lock = threading.Lock()
+_export_lock = threading.Lock()
+
+def available():
+    """True if onnxruntime is installed (it is an optional dependency)"""
+    import importlib.util
+    return importlib.util.find_spec('onnxruntime') is not None
+
+def set_threads(intra_op=0, inter_op=0):
+    """Thread counts for ONNX Runtime sessions created from now on"""
+    session_threads['intra_op'] = intra_op
+    session_threads['inter_op'] = inter_op
+
+def load_model(name, repo=None):
+    """Load a pretrained Demucs model (or bag of models) like the demucs CLI does"""
+    from demucs.pretrained import get_model
+
+    model = get_model(name, repo=Path(repo) if repo else None)
+    model.eval()
+    return model
+
+def is_hybrid(model):
+    """Hybrid (HDemucs/HTDemucs) models have a spectrogram branch, plain Demucs is time domain only"""
+    return hasattr(model, '_spec')
+
+def chunk_length(model):
+    """
+    The one input length a model's graph is exported for: its segment as apply_model splits it,
+    rounded up to a length the model accepts. Shorter chunks are zero-padded to it
+    """
+    length = int(model.samplerate * model.segment)
+    return model.valid_length(length) if hasattr(model, 'valid_length') else length
+
+def export_graph(model, name, index, length):
+    """
+    Export one model of a bag to ONNX for a fixed input length, once; later calls reuse the cache
+    Graphs of the same model for other lengths are removed
+    Returns the path of the .onnx file
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = os.path.join(CACHE_DIR, f"{name}-{index}-{length}.onnx")
+    with _export_lock:
+        if not os.path.exists(path):
+            _export(model, name, index, length, path)
+            for entry in os.listdir(CACHE_DIR):
+                if entry.startswith(f"{name}-{index}-") and entry.endswith('.onnx') and \
+                   entry != os.path.basename(path):
+                    os.remove(os.path.join(CACHE_DIR, entry))
+    return path
+
+def _export(model, name, index, length, path):
+    import torch
+
+    print(f"Exporting {name} (model {index}, {length} samples) to ONNX, cached in {CACHE_DIR}...")
+    cls = type(model)
+    CoreGraph, _ = _module_classes()
+    mix = 0.1 * torch.randn(1, model.audio_channels, length)
+    # Other processes may export the same graph, only a complete file is renamed into place
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    # ONNX Runtime has no bool EyeLike kernel, which Demucs' LocalState layers use to mask the
+    # diagonal; while tracing, a bool eye is built as a float eye cast to bool instead
+    eye = torch.eye
+    torch.eye = lambda *args, dtype=None, **kwargs: \
+        eye(*args, **kwargs).bool() if dtype == torch.bool else eye(*args, dtype=dtype, **kwargs)
+    try:
+        with torch.no_grad():
+            if is_hybrid(model):
+                mag = cls._magnitude(model, cls._spec(model, mix))
+                # PRESERVE keeps the attention layers CoreGraph switched to training mode
+                torch.onnx.export(CoreGraph(model), (mix, mag), tmp_path, input_names=['mix', 'mag'],
+                                  output_names=['time', 'spec'], opset_version=OPSET, do_constant_folding=True,
+                                  training=torch.onnx.TrainingMode.PRESERVE)
+            else:
+                torch.onnx.export(model, (mix,), tmp_path, input_names=['mix'], output_names=['time'],
+                                  opset_version=OPSET, do_constant_folding=True)
+    finally:
+        torch.eye = eye
+    os.replace(tmp_path, path)
+
+def get_session(path):
+    """One ONNX Runtime CPU session per exported graph and thread configuration"""
+    try:
+        import onnxruntime as ort
+    except ImportError:
+        raise ImportError("The ONNX backend needs onnxruntime: pip install onnxruntime")
+
+    key = (path, session_threads['intra_op'], session_threads['inter_op'])
+    with _lock:
+        if key not in _sessions:
+            options = ort.SessionOptions()
+            options.intra_op_num_threads = session_threads['intra_op']
+            options.inter_op_num_threads = session_threads['inter_op']
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            _sessions[key] = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        return _sessions[key]
+
+def _module_classes():
+    """
+    The torch.nn.Module subclasses of this backend, defined on first use so that importing
+    this module (e.g. for set_threads at startup) does not load torch
+    Returns (CoreGraph, OnnxDemucs)
+    """
+    if _classes:
+        return _classes['CoreGraph'], _classes['OnnxDemucs']
+
+    import copy
+    import torch
+    import torch.nn.functional as F
+
+    class CoreGraph(torch.nn.Module):
+        """
+        Forward pass of a hybrid Demucs model without the STFT and iSTFT
+        ONNX has no complex tensors, so the spectrogram is computed outside the graph and passed
+        in as its real magnitude channels, and the masked spectrogram is returned before the
+        iSTFT. The time branch output comes back as the model's regular output
+        """
+
+        def __init__(self, model):
+            super().__init__()
+            self.model = copy.deepcopy(model)
+            self.mag = None
+            self.spec_out = None
+            self.model._spec = lambda mix: None
+            self.model._magnitude = lambda z: self.mag
+            self.model._mask = lambda z, m: m
+            self.model._ispec = self._capture_spec
+            for module in self.model.modules():
+                if isinstance(module, torch.nn.MultiheadAttention):
+                    # Eval-mode attention (HTDemucs' transformer) takes PyTorch's fused fast path,
+                    # which has no ONNX export; training mode without dropout computes the same
+                    # result on the regular, exportable path
+                    module.train()
+                    module.dropout = 0.0
+
+        def _capture_spec(self, spec, length=None, scale=0):
+            self.spec_out = spec
+            # Added to the time branch output, which is then returned unchanged
+            return spec.new_zeros(())
+
+        def forward(self, mix, mag):
+            self.mag = mag
+            time_out = self.model(mix)
+            return time_out, self.spec_out
+
+    class OnnxDemucs(torch.nn.Module):
+        """
+        Drop-in for a Demucs model inside demucs.apply.apply_model: the spectrogram and iSTFT
+        run in PyTorch, everything in between in ONNX Runtime
+        Each model has a single exported graph for chunk_length(model), whatever the track length
+        or random shift. Shorter chunks are zero-padded to it and the output cropped again when the
+        model itself pads them that way (HTDemucs); the last chunk of a track for a model that runs
+        any length (HDemucs) goes through PyTorch, as padding would change its result
+        """
+
+        def __init__(self, model, name, index=0):
+            super().__init__()
+            self.model = model
+            self.name = name
+            self.index = index
+            self.sources = model.sources
+            self.samplerate = model.samplerate
+            self.audio_channels = model.audio_channels
+            self.segment = model.segment
+            self.chunk_length = chunk_length(model)
+            self.on_chunk = None
+
+        def valid_length(self, length):
+            return self.model.valid_length(length) if hasattr(self.model, 'valid_length') else length
+
+        def forward(self, mix):
+            model = self.model
+            length = mix.shape[-1]
+            if length > self.chunk_length:
+                raise ValueError(f"ONNX backend runs chunks of up to {self.chunk_length} samples, got {length}; "
+                                 f"use apply_model with split=True")
+
+            if self.valid_length(length) != self.chunk_length:
+                out = model(mix)
+            else:
+                out = self._run_session(F.pad(mix, (0, self.chunk_length - length)))[..., :length]
+            if self.on_chunk:
+                self.on_chunk()
+            return out
+
+        def _run_session(self, mix):
+            model = self.model
+            cls = type(model)
+            session = get_session(export_graph(model, self.name, self.index, self.chunk_length))
+            if not is_hybrid(model):
+                return torch.from_numpy(session.run(None, {'mix': mix.contiguous().numpy()})[0])
+
+            z = cls._spec(model, mix)
+            mag = cls._magnitude(model, z)
+            time_out, spec_out = session.run(None, {'mix': mix.contiguous().numpy(),
+                                                    'mag': mag.contiguous().numpy()})
+            zout = cls._mask(model, z, torch.from_numpy(spec_out))
+            return torch.from_numpy(time_out) + cls._ispec(model, zout, mix.shape[-1])
+
+    _classes.update(CoreGraph=CoreGraph, OnnxDemucs=OnnxDemucs)
+    return CoreGraph, OnnxDemucs
+
+def onnx_model(name, repo=None, cache=None):
+    """
+    Load a pretrained model with every sub-model running through ONNX Runtime
+    cache: dict kept by a worker between tracks; a model loaded into it is reused, not loaded again.
+    Do not share one cache between threads, a model reports progress to one caller at a time
+    """
+    from demucs.apply import BagOfModels
+
+    if cache is not None:
+        key = (name, repo)
+        if key not in cache:
+            cache[key] = onnx_model(name, repo)
+        return cache[key]
+
+    _, OnnxDemucs = _module_classes()
+    model = load_model(name, repo)
+    if isinstance(model, BagOfModels):
+        for i, sub_model in enumerate(model.models):
+            model.models[i] = OnnxDemucs(sub_model, name, i)
+        return model
+    return OnnxDemucs(model, name)
+
+def sub_models(model):
+    from demucs.apply import BagOfModels
+    return list(model.models) if isinstance(model, BagOfModels) else [model]
+
+def separate_file(input_file, output_root, name, repo=None, two_stems=None, progress_callback=None, model=None,
+                  cache=None):
+    """
+    Separate a file with the ONNX backend, the in-process counterpart of
+    `demucs -n <name> --out <output_root> [--two-stems <stem>] <input_file>`
+    Writes the same layout as the CLI, <output_root>/<name>/<track>/<source>.wav
+    cache: a worker's model cache, see onnx_model
+    Returns the folder with the stems
+    """
+    from demucs.apply import apply_model
+    from demucs.audio import save_audio
+    from demucs.separate import load_track
+
+    model = model or onnx_model(name, repo, cache)
+    wav = load_track(Path(input_file), model.audio_channels, model.samplerate)
+    ref = wav.mean(0)
+    wav = (wav - ref.mean()) / ref.std()
+
+    # apply_model does not report progress, count the chunks each sub-model runs instead
+    wrappers = sub_models(model)
+    stride_seconds = 0.75 * float(wrappers[0].segment)
+    total = len(wrappers) * math.ceil((wav.shape[-1] / model.samplerate + 0.5) / stride_seconds)
+    done = [0]
+
+    def on_chunk():
+        done[0] += 1
+        if progress_callback:
+            progress = min(100.0, 100.0 * done[0] / total)
+            progress_callback(progress, f"Separating stems: {progress:.1f}%")
+
+    for wrapper in wrappers:
+        wrapper.on_chunk = on_chunk
+
+    # Same settings as the demucs CLI defaults: one random shift, 25% overlap
+    sources = apply_model(model, wav[None], device='cpu', shifts=1, split=True, overlap=0.25)[0]
+    sources = sources * ref.std() + ref.mean()
+
+    folder = os.path.join(output_root, name, Path(input_file).stem)
+    os.makedirs(folder, exist_ok=True)
+
+    def save(source, stem):
+        save_audio(source, os.path.join(folder, f"{stem}.wav"), samplerate=model.samplerate,
+                   clip='rescale', bits_per_sample=16, as_float=False)
+
+    if two_stems is None:
+        for source, stem in zip(sources, model.sources):
+            save(source, stem)
+    else:
+        index = model.sources.index(two_stems)
+        save(sources[index], two_stems)
+        save(sum(source for i, source in enumerate(sources) if i != index), f"no_{two_stems}")
+    return folder
+
+def check_parity(name, repo=None, seed=0):
+    """
+    Run one chunk of noise through every sub-model with PyTorch and with ONNX Runtime
+    Returns the largest absolute output difference per sub-model
+    """
+    import torch
+
+    torch.manual_seed(seed)
+    errors = []
+    for torch_model, wrapper in zip(sub_models(load_model(name, repo)), sub_models(onnx_model(name, repo))):
+        mix = 0.1 * torch.randn(1, torch_model.audio_channels, wrapper.chunk_length)
+        with torch.no_grad():
+            errors.append((torch_model(mix) - wrapper(mix)).abs().max().item())
+    return errors
@@ -0,0 +1,287 @@
+import os
+import re
+import time
+
+# The analysis and separation modules pull in librosa, torch and DeepRhythm, so they are
+# imported on first use to keep the GUI and CLI entry points fast to start
+
+# Camelot wheel notation used for manual key overrides, e.g. '8A' or '12B'
+CAMELOT_PATTERN = re.compile(r'^(1[0-2]|[1-9])[AB]$')
+
+DRUM_PARTS = ('kick', 'snare', 'cymbals', 'toms')
+STEM_TARGETS = ('vocals', 'bass', 'other', 'drums') + DRUM_PARTS + ('instrumental',)
+DEFAULT_TARGETS = ('vocals', 'bass', 'other', 'drums') + DRUM_PARTS
+
+# Inference backends for the separation models: PyTorch via the demucs/drumsep CLIs, or
+# the same models exported to ONNX and run with ONNX Runtime on the CPU
+BACKENDS = ('torch', 'onnx')
+
+def analyze_track(file_path, predictor=None, bpm_result=None, peaks_dir=None, audio=None):
+    """
+    Run Module 1 (BPM and key analysis) on a single track
+    Pass a DeepRhythmPredictor to reuse an already loaded model, or a (bpm, confidence)
+    bpm_result from detect_bpm_batch to skip DeepRhythm entirely
+    audio: (y, sr) already decoded by detect_bpm_batch, skips decoding the file again
+    The track is decoded once; key, BPM and the 'fingerprint' for duplicate detection
+    are all computed from the same buffer
+    A waveform peak pyramid is cached in peaks_dir (default output/analysis, pass the job's
+    output root) for the GUI and reused while the file is unchanged, 'peaks' is the path of its index
+    """
+    from deeprhythm import DeepRhythmPredictor
+    from audio_decoder import decode
+    from step2_KeyAnalysis import detect_key
+    from fingerprint import compute_fingerprint
+    from waveform_peaks import build_peak_pyramid, find_cached_peaks, save_peak_pyramid
+
+    y, sr = audio if audio is not None else decode(file_path)
+    if bpm_result is not None:
+        bpm, confidence = bpm_result
+    else:
+        if predictor is None:
+            predictor = DeepRhythmPredictor()
+        bpm, confidence = predictor.predict_from_audio(y, sr, include_confidence=True)
+
+    camelot, full_key, key_conf = detect_key(file_path, y=y, sr=sr)[0]
+    fingerprint = compute_fingerprint(y, sr)
+
+    try:
+        peaks = find_cached_peaks(file_path, peaks_dir) or \
+            save_peak_pyramid(build_peak_pyramid(y), sr, len(y), file_path, peaks_dir)
+    except OSError as e:
+        print(f"Could not cache waveform peaks: {e}")
+        peaks = None
+
+    return {
+        'bpm': float(bpm),
+        'bpm_confidence': float(confidence),
+        'camelot': camelot,
+        'full_key': full_key,
+        'key_confidence': float(key_conf),
+        'duration': len(y) / sr,
+        'fingerprint': fingerprint,
+        'peaks': peaks
+    }
+
+def build_prefix(camelot_key, bpm):
+    """Create the key/BPM prefix used for every output file, e.g. '8A_124.00BPM_'"""
+    return f"{camelot_key}_{bpm:.2f}BPM_"
+
+def list_segments(stems_folder, base_name=''):
+    """Return the paths of the 8-bar segments under a stems folder, optionally of one track only"""
+    segments_folder = os.path.join(stems_folder, 'segments')
+    if not os.path.isdir(segments_folder):
+        return []
+    # Segments are named B{bar}_{stem file name}
+    return sorted(os.path.join(segments_folder, f) for f in os.listdir(segments_folder)
+                  if f.endswith('.wav') and f.split('_', 1)[-1].startswith(base_name))
+
+def plan_targets(targets=None):
+    """
+    Work out the minimal set of work for the requested output stems
+    targets: iterable of STEM_TARGETS, None for the default 8 stems
+    Raises ValueError for unknown or empty targets
+    """
+    if targets is not None:
+        # Targets may come straight from a JSON request body
+        invalid = [t for t in targets if not isinstance(t, str)]
+        if invalid:
+            raise ValueError(f"Stem targets must be names, got {', '.join(map(repr, invalid))}")
+    targets = set(DEFAULT_TARGETS if targets is None else targets)
+    unknown = targets - set(STEM_TARGETS)
+    if unknown:
+        raise ValueError(f"Unknown stem target(s): {', '.join(sorted(unknown))}")
+    if not targets:
+        raise ValueError("At least one stem target is required")
+
+    # Vocals and/or instrumental only: Demucs writes just vocals + no_vocals
+    two_stems = 'vocals' if targets <= {'vocals', 'instrumental'} else None
+    drum_parts = [part for part in DRUM_PARTS if part in targets]
+
+    return {
+        'targets': sorted(targets),
+        'two_stems': two_stems,
+        'drum_parts': drum_parts,
+        'mix_instrumental': 'instrumental' in targets and two_stems is None,
+        # Stem types as they appear at the end of output file names
+        'stem_types': sorted(f"drum_{t}" if t in DRUM_PARTS else t for t in targets)
+    }
+
+def mix_stems(stem_paths, output_path):
+    """Sum several stems of the same track into one file, e.g. drums + bass + other"""
+    import soundfile as sf
+
+    mix = None
+    for path in stem_paths:
+        y, sr = sf.read(path, dtype='float32')
+        mix = y if mix is None else mix + y
+    info = sf.info(stem_paths[0])
+    sf.write(output_path, mix, sr, subtype=info.subtype, format=info.format)
+    return output_path
+
+def process_track(file_path, camelot_key, bpm, output_folder, progress_callback=None, chop=True,
+                  fingerprint=None, duration=None, dedupe_index=None, on_duplicate='reuse',
+                  targets=None, segment_index=None, backend='torch', model_cache=None):
+    """
+    Run Module 2 (stem and drum separation) and optionally Module 3 (8-bar chopping)
+    progress_callback(progress, status_message) receives progress in percent, or None
+    when only the status message changed
+    targets selects the output stems (see STEM_TARGETS); stages no target needs are skipped
+    With a FingerprintIndex, near-duplicates of processed tracks are not separated again:
+    on_duplicate='reuse' returns the existing outputs, 'skip' returns no outputs
+    Silent segments and silent drum stems are skipped; what was skipped is returned under 'skipped'
+    With a SegmentIndex, features of every written segment are stored for loop search
+    backend selects how the separation models run, see BACKENDS. With backend='onnx', the models
+    are kept in model_cache (a dict reused across tracks by one worker) instead of loaded per track;
+    the torch backend runs the demucs/drumsep CLIs, which load their models on every track
+    Returns a dict with 'stems' and 'segments' paths and per-stage 'timings', or None if a stage failed
+    """
+    from step3_1_StemSeperation import separate_stems
+    from step3_2_DrumSeperation import separate_drums
+    from step4_ChopSegments8Bars import process_stems_to_segments, extract_stem_type_from_filename
+    from write_behind import WriteBehindQueue
+
+    def report(progress, status_message):
+        if progress_callback:
+            progress_callback(progress, status_message)
+
+    plan = plan_targets(targets)
+    prefix = build_prefix(camelot_key, bpm)
+    base_name = f"{prefix}{os.path.splitext(os.path.basename(file_path))[0]}"
+    output_folder = os.path.abspath(output_folder)
+    os.makedirs(output_folder, exist_ok=True)
+
+    def requested(paths):
+        return [p for p in paths if extract_stem_type_from_filename(os.path.basename(p)) in plan['stem_types']]
+
+    if dedupe_index is not None and fingerprint is not None:
+        match, score = dedupe_index.find_match(fingerprint, duration)
+        if match and on_duplicate == 'reuse' and len(requested(match['stems'])) < len(plan['stem_types']):
+            print(f"{match['path']} matches (score {score:.3f}) but lacks some requested stems, separating again")
+        elif match:
+            print(f"{os.path.basename(file_path)} matches {match['path']} (score {score:.3f})")
+            duplicate = {'path': match['path'], 'score': score}
+            if on_duplicate == 'skip':
+                report(None, f"Skipped duplicate of {os.path.basename(match['path'])} ({score:.0%} match)")
+                return {'stems': [], 'segments': [], 'duplicate': duplicate, 'skipped': {}, 'timings': {}}
+            report(None, f"Reused stems of {os.path.basename(match['path'])} ({score:.0%} match)")
+            return {'stems': requested(match['stems']), 'segments': requested(match['segments']),
+                    'duplicate': duplicate, 'skipped': {}, 'timings': {}}
+        else:
+            print(f"No duplicate found (best score {score:.3f})")
+
+    summary = {}
+    timings = {}
+
+    # Drum parts and segments are handed to writer threads, so the next one is computed
+    # while the previous one is flushed to disk
+    writer = WriteBehindQueue()
+    writes = {'files': 0, 'bytes': 0, 'queue_wait': 0.0, 'write_time': 0.0}
+
+    def flush_writes():
+        """Barrier before written files are read back or reported; False if a write failed"""
+        stats = writer.flush()
+        for key in writes:
+            writes[key] += stats[key]
+        if stats['failed']:
+            report(None, f"Failed to write {len(stats['failed'])} file(s)")
+            return False
+        return True
+
+    try:
+        report(None, "Starting stem separation...")
+        stage_start = time.time()
+        stem_paths = separate_stems(file_path, output_folder,
+                                    progress_callback=progress_callback,
+                                    prefix=prefix,
+                                    two_stems=plan['two_stems'],
+                                    backend=backend,
+                                    model_cache=model_cache)
+        timings['stem separation'] = time.time() - stage_start
+        if not stem_paths:
+            report(None, "Stem separation failed")
+            return None
+
+        if plan['drum_parts'] and 'DRUMS' in stem_paths:
+            report(None, "Separating drum components...")
+            stage_start = time.time()
+            if not separate_drums(stem_paths['DRUMS'], output_folder, camelot_key, bpm, base_name,
+                                  summary=summary, parts=plan['drum_parts'], writer=writer,
+                                  backend=backend, model_cache=model_cache):
+                report(None, "Drum separation failed")
+                return None
+            # The instrumental mix and chopping read the drum parts back
+            if not flush_writes():
+                return None
+            timings['drum separation'] = time.time() - stage_start
+        else:
+            timings['drum separation'] = 'skipped (no drum parts requested)'
+
+        if plan['mix_instrumental']:
+            stage_start = time.time()
+            mix_stems([stem_paths[s] for s in ('DRUMS', 'BASS', 'OTHER') if s in stem_paths],
+                      os.path.join(output_folder, f"{base_name}_instrumental.wav"))
+            timings['instrumental mix'] = time.time() - stage_start
+
+        # Demucs always writes its full set of stems, drop the ones nobody asked for
+        for stem_type, path in stem_paths.items():
+            if stem_type.lower() not in plan['targets'] and os.path.exists(path):
+                os.remove(path)
+
+        segments = []
+        if chop:
+            report(None, "Chopping stems into 8-bar segments...")
+            stage_start = time.time()
+            if not process_stems_to_segments(output_folder, progress_callback, summary=summary,
+                                             name_prefix=base_name, stem_types=plan['stem_types'],
+                                             index=segment_index, writer=writer):
+                report(None, "Failed to create segments")
+                return None
+            if not flush_writes():
+                return None
+            timings['chopping'] = time.time() - stage_start
+            segments = list_segments(output_folder, base_name)
+            report(None, "Successfully created 8-bar segments!")
+        else:
+            timings['chopping'] = 'skipped (Module 3 disabled)'
+
+        # Drum parts are written next to the stems under the same base name
+        all_stems = requested(os.path.join(output_folder, f) for f in sorted(os.listdir(output_folder))
+                              if f.endswith('.wav') and f.startswith(base_name))
+
+        timings['write queue wait'] = writes['queue_wait']
+        timings['disk writes'] = writes['write_time']
+        print_skip_summary(summary)
+        print_timing_report(timings)
+        print(f"Wrote {writes['files']} file(s), {writes['bytes'] / 1024 ** 2:.1f} MB in the background")
+
+        if dedupe_index is not None and fingerprint is not None:
+            dedupe_index.add(file_path, duration, fingerprint, all_stems, segments)
+
+        return {
+            'stems': all_stems,
+            'segments': segments,
+            'duplicate': None,
+            'skipped': summary,
+            'timings': timings,
+            'writes': writes
+        }
+    finally:
+        writer.close()
+
+def print_timing_report(timings):
+    """Print how long each stage took, or why it did not run"""
+    print("\nStage timings:")
+    for stage, value in timings.items():
+        if isinstance(value, str):
+            print(f"  {stage:18s} {value}")
+        else:
+            print(f"  {stage:18s} {value:8.2f} s")
+
+def print_skip_summary(summary):
+    """Print what the silence gate skipped for a track"""
+    if 'skipped_drumsep' in summary:
+        drums = summary['skipped_drumsep']
+        print(f"Skipped drumsep: drum stem is silent (RMS {drums['rms_db']:.1f} dBFS, peak {drums['peak_db']:.1f} dBFS)")
+    skipped_segments = summary.get('skipped_segments', {})
+    for stem_file, bars in sorted(skipped_segments.items()):
+        print(f"Skipped {len(bars)} silent segment(s) of {stem_file}: bars {', '.join(map(str, bars))}")
\ No newline at end of file
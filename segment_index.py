@@ -0,0 +1,163 @@
+import os
+import time
+import sqlite3
+import argparse
+import numpy as np
+
+HOP_LENGTH = 512
+N_FFT = 2048
+
+def compute_segment_features(y, sr, segment_len):
+    """
+    Per-segment loop search features of a stem that is already in memory
+    The spectrogram is computed one segment at a time from a mono mix of that segment, so
+    the transform never holds more than one segment (~10 MB for 8 bars at 120 BPM); only the
+    small per-frame onset envelope of the whole stem is kept, so onsets are picked against
+    one threshold for the stem like before
+    y: (samples,) or (samples, channels)
+    Returns a dict of arrays with one entry per full segment:
+    rms_db, peak_db, onset_density (onsets per second), spectral_centroid (Hz)
+    """
+    import librosa
+    from silence_gate import segment_levels
+
+    rms_db, peak_db = segment_levels(y, segment_len)
+    num_segments = len(rms_db)
+    if num_segments == 0:
+        empty = np.zeros(0)
+        return {'rms_db': empty, 'peak_db': empty, 'onset_density': empty, 'spectral_centroid': empty}
+
+    centroid_mean = np.zeros(num_segments)
+    envelopes = []
+    # Each segment's transform starts a few frames early, so an onset right on the boundary
+    # is still measured against the audio before it; those context frames are dropped again
+    context = N_FFT // HOP_LENGTH
+    for i in range(num_segments):
+        start = max(i * segment_len - context * HOP_LENGTH, 0)
+        mono = y[start:(i + 1) * segment_len]
+        if mono.ndim > 1:
+            mono = mono.mean(axis=1)
+        mono = np.ascontiguousarray(mono, dtype=np.float32)
+
+        S = np.abs(librosa.stft(mono, n_fft=N_FFT, hop_length=HOP_LENGTH))
+        # A fixed reference keeps the dB scale comparable between segments
+        envelope = librosa.onset.onset_strength(S=librosa.amplitude_to_db(S, ref=1.0, top_db=None), sr=sr)
+        skip = context if i > 0 else 0
+        centroid_mean[i] = librosa.feature.spectral_centroid(S=S[:, skip:], sr=sr)[0].mean()
+        envelopes.append(envelope[skip:])
+
+    onset_env = np.concatenate(envelopes)
+    onset_frames = librosa.onset.onset_detect(onset_envelope=onset_env, sr=sr, hop_length=HOP_LENGTH)
+    frame_segment = np.repeat(np.arange(num_segments), [len(e) for e in envelopes])
+    onsets_per_segment = np.bincount(frame_segment[onset_frames], minlength=num_segments)
+    onset_density = onsets_per_segment / (segment_len / sr)
+
+    return {
+        'rms_db': rms_db,
+        'peak_db': peak_db,
+        'onset_density': onset_density,
+        'spectral_centroid': centroid_mean
+    }
+
+class SegmentIndex:
+    """
+    Local SQLite index of 8-bar segments and their features, so loops can be searched
+    without decoding any audio. A new connection is opened per call for thread safety
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self.connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS segments (
+                    path TEXT PRIMARY KEY,
+                    source TEXT NOT NULL,
+                    stem TEXT,
+                    bar INTEGER NOT NULL,
+                    bpm REAL,
+                    camelot TEXT,
+                    rms_db REAL,
+                    peak_db REAL,
+                    onset_density REAL,
+                    spectral_centroid REAL,
+                    created REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS segments_lookup ON segments (stem, camelot, bpm)")
+
+    def connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def add_segments(self, rows):
+        """rows: iterable of dicts with the column names of the segments table (except created)"""
+        now = time.time()
+        with self.connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO segments (path, source, stem, bar, bpm, camelot, rms_db, peak_db, "
+                "onset_density, spectral_centroid, created) VALUES "
+                "(:path, :source, :stem, :bar, :bpm, :camelot, :rms_db, :peak_db, "
+                ":onset_density, :spectral_centroid, :created)",
+                [dict(row, created=now) for row in rows]
+            )
+
+    def query(self, stem=None, camelot=None, bpm_min=None, bpm_max=None,
+              min_onset_density=None, max_onset_density=None, min_rms_db=None, limit=None):
+        """
+        Find segments matching all given criteria, e.g.
+        query(stem='drum_snare', camelot='8A', bpm_min=120, bpm_max=124, min_onset_density=4)
+        Returns a list of dicts ordered by BPM and bar
+        """
+        # Drum parts are stored as drum_<part>, accept the bare part name too
+        if stem in ('kick', 'snare', 'cymbals', 'toms'):
+            stem = f"drum_{stem}"
+
+        conditions, params = [], []
+        for column, op, value in (('stem', '=', stem), ('camelot', '=', camelot),
+                                  ('bpm', '>=', bpm_min), ('bpm', '<=', bpm_max),
+                                  ('onset_density', '>=', min_onset_density),
+                                  ('onset_density', '<=', max_onset_density),
+                                  ('rms_db', '>=', min_rms_db)):
+            if value is not None:
+                conditions.append(f"{column} {op} ?")
+                params.append(value)
+
+        sql = "SELECT * FROM segments"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY bpm, source, bar"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+
+        with self.connect() as conn:
+            conn.row_factory = sqlite3.Row
+            return [dict(row) for row in conn.execute(sql, params)]
+
+def default_index_path():
+    return os.path.join(os.getcwd(), 'output', 'segments.db')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search the 8-bar segment index")
+    parser.add_argument('--index', default=default_index_path(), help="Path to segments.db")
+    parser.add_argument('--stem', help="Stem type, e.g. vocals, bass, drum_snare")
+    parser.add_argument('--key', help="Camelot key, e.g. 8A")
+    parser.add_argument('--bpm', help="BPM or range, e.g. 124 or 120-124")
+    parser.add_argument('--min-density', type=float, help="Minimum onsets per second")
+    parser.add_argument('--max-density', type=float, help="Maximum onsets per second")
+    parser.add_argument('--min-rms', type=float, help="Minimum RMS level in dBFS")
+    parser.add_argument('--limit', type=int, default=50)
+    args = parser.parse_args()
+
+    bpm_min = bpm_max = None
+    if args.bpm:
+        low, _, high = args.bpm.partition('-')
+        bpm_min, bpm_max = float(low), float(high or low)
+
+    results = SegmentIndex(args.index).query(args.stem, args.key, bpm_min, bpm_max,
+                                             args.min_density, args.max_density, args.min_rms, args.limit)
+    for row in results:
+        print(f"{str(row['camelot']):>4s} {row['bpm']:7.2f} BPM  {str(row['stem']):12s} B{row['bar']:<4d} "
+              f"RMS {row['rms_db']:6.1f} dB  {row['onset_density']:5.2f} onsets/s  "
+              f"{row['spectral_centroid']:7.0f} Hz  {row['path']}")
+    print(f"{len(results)} segment(s)")
\ No newline at end of file
@@ -0,0 +1,343 @@
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import socket
+import argparse
+import threading
+import subprocess
+
+AUDIO_EXTENSIONS = ('.mp3', '.wav', '.m4a', '.flac')
+LEASE_DIR = '.leases'
+DONE_DIR = '.done'
+FAILED_DIR = '.failed'
+
+def write_json_atomic(path, data):
+    """Write JSON via a temporary file and rename, readers never see a partial file"""
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+class Lease:
+    """
+    Exclusive claim on one input track, held through a lock file in the shared input folder
+    The file is created with O_EXCL, so only one worker on any host can create it. The holder
+    refreshes its expiry from a heartbeat thread; a lease whose expiry passed belongs to a
+    crashed worker and may be reclaimed. Hosts need roughly synchronized clocks (NTP)
+    """
+
+    def __init__(self, path, worker_id, duration):
+        self.path = path
+        self.worker_id = worker_id
+        self.duration = duration
+        self.token = uuid.uuid4().hex
+        self.lost = threading.Event()
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    def _record(self):
+        now = time.time()
+        return {
+            'worker': self.worker_id,
+            'host': socket.gethostname(),
+            'pid': os.getpid(),
+            'token': self.token,
+            'heartbeat': now,
+            'expires': now + self.duration
+        }
+
+    def acquire(self):
+        """Try to claim the track, reclaiming an expired lease. Returns True on success"""
+        if self._create():
+            return True
+
+        current = read_json(self.path)
+        if current is not None and current.get('expires', 0) > time.time():
+            return False
+        if current is None:
+            # Unreadable lease: either half-written by a worker that just created it or left
+            # behind by one that crashed mid-write. Only the latter is old
+            try:
+                if time.time() - os.path.getmtime(self.path) < self.duration:
+                    return False
+            except FileNotFoundError:
+                return False
+
+        # Expired (or unreadable half-written) lease: move it aside atomically. Only one
+        # worker's rename can succeed, the others see FileNotFoundError
+        stale_path = f"{self.path}.stale-{self.token}"
+        try:
+            os.rename(self.path, stale_path)
+        except FileNotFoundError:
+            return False
+
+        stolen = read_json(stale_path)
+        if stolen is not None and current is not None and stolen.get('token') != current.get('token'):
+            # Someone renewed or re-created the lease between our read and rename, put it back
+            try:
+                os.link(stale_path, self.path)
+            except FileExistsError:
+                pass
+            os.remove(stale_path)
+            return False
+
+        os.remove(stale_path)
+        if current is not None:
+            print(f"[{self.worker_id}] Reclaimed expired lease of {current.get('worker')} "
+                  f"on {os.path.basename(self.path)}")
+        return self._create()
+
+    def _create(self):
+        try:
+            fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self._record(), f)
+            f.flush()
+            os.fsync(f.fileno())
+        self._heartbeat = threading.Thread(target=self._heartbeat_loop, daemon=True)
+        self._heartbeat.start()
+        return True
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(self.duration / 4):
+            try:
+                if not self.held():
+                    print(f"[{self.worker_id}] Lost lease on {os.path.basename(self.path)}")
+                    self.lost.set()
+                    return
+                write_json_atomic(self.path, self._record())
+            except Exception as e:
+                # Without heartbeats the lease expires and another worker may take the track
+                print(f"[{self.worker_id}] Could not renew lease on {os.path.basename(self.path)}: {e}")
+                self.lost.set()
+                return
+
+    def held(self):
+        """True while the lease file still carries this holder's token"""
+        if self.lost.is_set():
+            return False
+        current = read_json(self.path)
+        return current is not None and current.get('token') == self.token
+
+    def release(self):
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+        current = read_json(self.path)
+        if current is not None and current.get('token') == self.token:
+            os.remove(self.path)
+
+class ShardWorker:
+    """
+    Claims tracks from a shared input folder and runs the full analysis, separation and
+    chopping pipeline on each. Results are built in a temporary folder and renamed to a
+    folder of their own, <file name>@<version>; writing the done marker that points at it is the
+    commit, so a track is either done with complete output or pending
+    """
+
+    def __init__(self, input_dir, output_dir, worker_id=None, lease_seconds=120, targets=None,
+                 chop=True, poll_seconds=5.0, watch=False, backend='torch'):
+        self.input_dir = os.path.abspath(input_dir)
+        self.output_dir = os.path.abspath(output_dir)
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.lease_seconds = lease_seconds
+        self.targets = targets
+        self.chop = chop
+        self.poll_seconds = poll_seconds
+        self.watch = watch
+        self.backend = backend
+        self.predictor = None
+        for folder in (LEASE_DIR, DONE_DIR, FAILED_DIR):
+            os.makedirs(os.path.join(self.input_dir, folder), exist_ok=True)
+        os.makedirs(self.output_dir, exist_ok=True)
+
+    def marker(self, folder, track):
+        return os.path.join(self.input_dir, folder, f"{track}.json")
+
+    def outputs(self, prefix, digits):
+        """
+        Output folders named <prefix><token>, where the token is exactly `digits` hex digits
+        Folders are keyed on the full input file name, so song.mp3 and song.wav, or song and
+        song-remix, never match each other's folders
+        """
+        return [entry for entry in os.listdir(self.output_dir)
+                if entry.startswith(prefix) and len(entry) == len(prefix) + digits
+                and all(c in '0123456789abcdef' for c in entry[len(prefix):])]
+
+    def pending_tracks(self):
+        """Tracks without a done or failed marker"""
+        return [f for f in sorted(os.listdir(self.input_dir))
+                if f.lower().endswith(AUDIO_EXTENSIONS)
+                and not os.path.exists(self.marker(DONE_DIR, f))
+                and not os.path.exists(self.marker(FAILED_DIR, f))]
+
+    def run(self):
+        print(f"[{self.worker_id}] Watching {self.input_dir}")
+        processed = 0
+        while True:
+            pending = self.pending_tracks()
+            claimed = False
+            for track in pending:
+                lease = Lease(os.path.join(self.input_dir, LEASE_DIR, f"{track}.lease"),
+                              self.worker_id, self.lease_seconds)
+                if not lease.acquire():
+                    continue
+                claimed = True
+                try:
+                    # Another worker may have finished it between listing and claiming
+                    if not os.path.exists(self.marker(DONE_DIR, track)):
+                        self.process(track, lease)
+                        processed += 1
+                finally:
+                    lease.release()
+                break
+
+            if not claimed:
+                if not pending and not self.watch:
+                    break
+                # Everything left is leased by other workers, wait in case one of them dies
+                time.sleep(self.poll_seconds)
+
+        print(f"[{self.worker_id}] No work left, processed {processed} track(s)")
+        return processed
+
+    def process(self, track, lease):
+        from pipeline import analyze_track, process_track
+
+        print(f"\n[{self.worker_id}] Processing {track}")
+        start_time = time.time()
+        final_dir = os.path.join(self.output_dir, f"{track}@{lease.token[:12]}")
+        tmp_dir = os.path.join(self.output_dir, f".tmp-{track}-{lease.token}")
+
+        # Leftovers of a crashed attempt at this track
+        for entry in self.outputs(f".tmp-{track}-", len(lease.token)):
+            if entry != os.path.basename(tmp_dir):
+                shutil.rmtree(os.path.join(self.output_dir, entry), ignore_errors=True)
+
+        try:
+            if self.predictor is None:
+                from deeprhythm import DeepRhythmPredictor
+                self.predictor = DeepRhythmPredictor()
+
+            file_path = os.path.join(self.input_dir, track)
+            analysis = analyze_track(file_path, predictor=self.predictor,
+                                     peaks_dir=os.path.join(self.output_dir, 'analysis'))
+            analysis.pop('fingerprint')
+            result = process_track(file_path, analysis['camelot'], analysis['bpm'], tmp_dir,
+                                   chop=self.chop, targets=self.targets, backend=self.backend)
+            if result is None:
+                raise RuntimeError("Pipeline stage failed, see log above")
+            # Check the lease file itself, not only the heartbeat's view of it
+            if not lease.held():
+                raise RuntimeError("Lease was lost while processing, discarding results")
+
+            # Publish: the rename to a new folder name is atomic, and the done marker that
+            # points at it commits the track. A crash in between leaves an unreferenced folder
+            # and no marker, so the track is simply processed again
+            os.rename(tmp_dir, final_dir)
+
+            relocate = lambda paths: [os.path.join(final_dir, os.path.relpath(p, tmp_dir)) for p in paths]
+            write_json_atomic(self.marker(DONE_DIR, track), {
+                'worker': self.worker_id,
+                'finished': time.time(),
+                'seconds': time.time() - start_time,
+                'analysis': analysis,
+                'output': final_dir,
+                'stems': relocate(result['stems']),
+                'segments': relocate(result['segments'])
+            })
+
+            # Output of earlier attempts is no longer referenced by the marker
+            if lease.held():
+                for entry in self.outputs(f"{track}@", 12):
+                    if entry != os.path.basename(final_dir):
+                        shutil.rmtree(os.path.join(self.output_dir, entry), ignore_errors=True)
+            print(f"[{self.worker_id}] Finished {track} in {time.time() - start_time:.2f} seconds")
+
+        except Exception as e:
+            print(f"[{self.worker_id}] Failed {track}: {e}")
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            if not lease.lost.is_set():
+                write_json_atomic(self.marker(FAILED_DIR, track), {
+                    'worker': self.worker_id,
+                    'failed': time.time(),
+                    'error': str(e)
+                })
+
+def launch_local_workers(num_workers, args):
+    """Start several worker processes on this machine and wait for all of them"""
+    host = socket.gethostname()
+    child_argv = ['--input', args.input, '--output', args.output,
+                  '--lease-seconds', str(args.lease_seconds), '--backend', args.backend,
+                  '--onnx-threads', str(args.onnx_threads)]
+    if args.targets:
+        child_argv += ['--targets', args.targets]
+    if args.no_chop:
+        child_argv.append('--no-chop')
+    if args.watch:
+        child_argv.append('--watch')
+
+    processes = [subprocess.Popen([sys.executable, os.path.abspath(__file__)] + child_argv +
+                                  ['--worker-id', f"{host}-w{i}"])
+                 for i in range(num_workers)]
+    return max(p.wait() for p in processes)
+
+if __name__ == "__main__":
+    from pipeline import BACKENDS, plan_targets
+
+    parser = argparse.ArgumentParser(description="Process a shared input folder with several workers, "
+                                                 "on one or more hosts")
+    parser.add_argument('--input', required=True, help="Shared folder with the songs to process")
+    parser.add_argument('--output', required=True, help="Shared folder for the results")
+    parser.add_argument('--worker-id', default=None, help="Name of this worker (default: host-pid)")
+    parser.add_argument('--local-workers', type=int, default=1,
+                        help="Start this many worker processes on this machine")
+    parser.add_argument('--lease-seconds', type=float, default=120,
+                        help="Lease expiry; a crashed worker's track is reclaimed after this long")
+    parser.add_argument('--targets', default=None, help="Comma separated stems to produce")
+    parser.add_argument('--no-chop', action='store_true', help="Skip Module 3 segment chopping")
+    parser.add_argument('--watch', action='store_true', help="Keep polling for new songs instead of exiting")
+    parser.add_argument('--retry-failed', action='store_true', help="Clear failed markers before starting")
+    parser.add_argument('--backend', choices=BACKENDS, default='torch', help="Separation inference backend")
+    parser.add_argument('--onnx-threads', type=int, default=0,
+                        help="ONNX Runtime intra-op threads per worker (default: one per core)")
+    args = parser.parse_args()
+
+    # A bad target would fail every track in the shared inbox, check it before claiming any
+    targets = args.targets.split(',') if args.targets else None
+    try:
+        plan_targets(targets)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.backend == 'onnx':
+        from onnx_backend import available
+        if not available():
+            parser.error("--backend onnx needs onnxruntime: pip install onnxruntime")
+
+    if args.retry_failed:
+        shutil.rmtree(os.path.join(args.input, FAILED_DIR), ignore_errors=True)
+
+    if args.local_workers > 1:
+        sys.exit(launch_local_workers(args.local_workers, args))
+
+    if args.onnx_threads:
+        from onnx_backend import set_threads
+        set_threads(args.onnx_threads)
+
+    worker = ShardWorker(args.input, args.output, args.worker_id, args.lease_seconds, targets,
+                         chop=not args.no_chop, watch=args.watch, backend=args.backend)
+    worker.run()
\ No newline at end of file
@@ -0,0 +1,46 @@
+import numpy as np
+
+# A block counts as silent only when both its RMS and its peak are below these levels,
+# so a sparse stem with a single loud hit in 8 bars is still kept
+RMS_THRESHOLD_DB = -60.0
+PEAK_THRESHOLD_DB = -40.0
+
+def to_db(amplitude):
+    """Convert linear amplitude (scalar or array) to dBFS"""
+    return 20 * np.log10(np.maximum(amplitude, 1e-10))
+
+def segment_levels(y, segment_len):
+    """
+    RMS and peak level in dBFS of every full segment of a buffer, in one vectorized pass
+    y: (samples,) or (samples, channels) as returned by soundfile
+    Returns (rms_db, peak_db) arrays with one entry per segment
+    """
+    # An empty buffer has no segments; checking first also avoids dividing by a zero length
+    if segment_len <= 0 or np.size(y) == 0:
+        return np.zeros(0), np.zeros(0)
+    num_segments = len(y) // segment_len
+    if num_segments == 0:
+        return np.zeros(0), np.zeros(0)
+
+    frames = y[:num_segments * segment_len].reshape(num_segments, segment_len, -1)
+
+    # einsum and max/min work on views, no squared or absolute copy of the stem is made
+    sum_squares = np.einsum('ijk,ijk->i', frames, frames)
+    rms = np.sqrt(sum_squares / (segment_len * frames.shape[2]))
+    peak = np.maximum(frames.max(axis=(1, 2)), -frames.min(axis=(1, 2)))
+    return to_db(rms), to_db(peak)
+
+def silent_mask(rms_db, peak_db, rms_threshold_db=RMS_THRESHOLD_DB, peak_threshold_db=PEAK_THRESHOLD_DB):
+    """Boolean mask of the segments that are below both thresholds"""
+    return (rms_db < rms_threshold_db) & (peak_db < peak_threshold_db)
+
+def is_silent(y, rms_threshold_db=RMS_THRESHOLD_DB, peak_threshold_db=PEAK_THRESHOLD_DB):
+    """
+    Check a whole buffer against the gate, an empty buffer counts as silent
+    Returns (silent, rms_db, peak_db)
+    """
+    rms_db, peak_db = segment_levels(y, len(y))
+    if len(rms_db) == 0:
+        return True, float(to_db(0)), float(to_db(0))
+    silent = bool(silent_mask(rms_db, peak_db, rms_threshold_db, peak_threshold_db)[0])
+    return silent, float(rms_db[0]), float(peak_db[0])
\ No newline at end of file
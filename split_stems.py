@@ -1,20 +1,100 @@
-from step3_1_StemSeperation import separate_stems
-import tqdm
+from pipeline import BACKENDS, CAMELOT_PATTERN, DEFAULT_TARGETS, STEM_TARGETS, analyze_track, plan_targets, process_track
 import os
+import sys
+import math
+import argparse
 import tkinter as tk
 from tkinter import ttk
-from step1_BPMAnalysis import load_and_analyze_bpm
-from deeprhythm import DeepRhythmPredictor
-import librosa
-from step2_KeyAnalysis import detect_key, detect_key_and_rename
-import soundfile as sf
-import shutil
 from concurrent.futures import ThreadPoolExecutor
+import queue
 import time
 from datetime import datetime
 
+AUDIO_EXTENSIONS = ('.mp3', '.wav', '.m4a', '.flac')
+
+# How often the Tk loop drains the worker event queue
+POLL_INTERVAL_MS = 100
+# Headless mode detects BPM for this many files per batch and holds their decoded audio
+# (~25 MB per 5 minutes at 22.05 kHz mono) until each file is processed
+BPM_GROUP_FILES = 8
+
+class WaveformView:
+    """
+    Zoomable waveform drawn from a cached peak pyramid, one line per pixel column
+    Mouse wheel zooms around the pointer, dragging pans
+    """
+
+    def __init__(self, parent, width=600, height=80):
+        self.canvas = tk.Canvas(parent, width=width, height=height, background='#1e1e1e',
+                                highlightthickness=0)
+        self.pyramid = None
+        self.view_start = 0
+        self.view_end = 0
+        self.drag_x = None
+        self.canvas.bind('<Configure>', lambda event: self.redraw())
+        self.canvas.bind('<MouseWheel>', lambda event: self.zoom(event.x, 0.8 if event.delta > 0 else 1.25))
+        self.canvas.bind('<Button-4>', lambda event: self.zoom(event.x, 0.8))
+        self.canvas.bind('<Button-5>', lambda event: self.zoom(event.x, 1.25))
+        self.canvas.bind('<ButtonPress-1>', self.start_drag)
+        self.canvas.bind('<B1-Motion>', self.drag)
+
+    def set_pyramid(self, pyramid):
+        self.pyramid = pyramid
+        self.view_start = 0
+        self.view_end = pyramid.num_samples if pyramid else 0
+        self.redraw()
+
+    def redraw(self):
+        self.canvas.delete('all')
+        if self.pyramid is None:
+            return
+        width = self.canvas.winfo_width()
+        height = self.canvas.winfo_height()
+        mins, maxs = self.pyramid.view(self.view_start, self.view_end, width)
+        if len(mins) == 0:
+            return
+
+        # Spread the columns over the canvas when zoomed in past one bin per pixel
+        middle = height / 2
+        step = width / len(mins)
+        for i, (low, high) in enumerate(zip(mins, maxs)):
+            x = i * step
+            self.canvas.create_line(x, middle - high * middle, x, middle - low * middle + 1, fill='#4fc3f7')
+
+        seconds = self.view_start / self.pyramid.sr
+        visible = (self.view_end - self.view_start) / self.pyramid.sr
+        self.canvas.create_text(4, 2, anchor='nw', fill='#bbbbbb', font=('TkDefaultFont', 8),
+                                text=f"{seconds:.2f}s +{visible:.2f}s")
+
+    def zoom(self, x, factor):
+        span = self.view_end - self.view_start
+        if self.pyramid is None or span <= 0:
+            return
+        anchor = self.view_start + span * x / max(self.canvas.winfo_width(), 1)
+        # Never zoom in closer than ~2 samples per pixel or out past the whole track
+        new_span = min(max(span * factor, self.canvas.winfo_width() * 2), self.pyramid.num_samples)
+        self.view_start = anchor - (anchor - self.view_start) * new_span / span
+        self.set_view(self.view_start, self.view_start + new_span)
+
+    def start_drag(self, event):
+        self.drag_x = event.x
+
+    def drag(self, event):
+        if self.pyramid is None or self.drag_x is None:
+            return
+        samples_per_pixel = (self.view_end - self.view_start) / max(self.canvas.winfo_width(), 1)
+        shift = (self.drag_x - event.x) * samples_per_pixel
+        self.drag_x = event.x
+        self.set_view(self.view_start + shift, self.view_end + shift)
+
+    def set_view(self, start, end):
+        span = end - start
+        start = max(min(start, self.pyramid.num_samples - span), 0)
+        self.view_start, self.view_end = int(start), int(start + span)
+        self.redraw()
+
 class AudioAnalysisGUI:
-    def __init__(self):
+    def __init__(self, backend='torch'):
         self.start_time = time.time()  # Add start time tracking
         self.root = tk.Tk()
         self.root.title("Audio Analysis")
@@ -40,18 +120,38 @@ class AudioAnalysisGUI:
         self.module2_enabled = tk.BooleanVar(value=True)
         self.module3_enabled = tk.BooleanVar(value=True)
         
+        # Stem target checkboxes, only the work the checked stems need is done
+        self.target_enabled = {target: tk.BooleanVar(value=target in DEFAULT_TARGETS)
+                               for target in STEM_TARGETS}
+        
         # Add progress tracking variable
         self.current_progress = 0
         
+        # Worker threads never touch Tk; they post events that poll_events applies
+        self.events = queue.Queue()
+        self.process_executor = ThreadPoolExecutor(max_workers=1)
+        self.analysis_executor = ThreadPoolExecutor(max_workers=1)
+        self.analysis_futures = {}
+        self.analysis_results = {}
+        self.predictor = None  # Only used from the analysis thread
+        self.processing = False
+        # Separation backend from --backend; ONNX models stay loaded between files
+        self.backend = backend
+        self.model_cache = {}  # Only used from the processing thread
+        
         # Find audio files in current directory
-        self.scan_directory()
         self.setup_gui()
+        self.scan_directory()
+        self.root.after(POLL_INTERVAL_MS, self.poll_events)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
     def scan_directory(self):
         current_dir = os.getcwd()
         self.files_to_process = [f for f in os.listdir(current_dir) 
-                               if f.lower().endswith(('.mp3', '.wav', '.m4a', '.flac'))]
+                               if f.lower().endswith(AUDIO_EXTENSIONS)]
         if self.files_to_process:
+            self.file_label.config(text=self.files_to_process[0])
+            self.status_label.config(text="Analyzing BPM and key...")
             self.analyze_file(self.files_to_process[0])
 
     def setup_gui(self):
@@ -59,10 +159,13 @@ class AudioAnalysisGUI:
         file_frame = ttk.LabelFrame(self.root, text="Current File", padding="10")
         file_frame.grid(row=0, column=0, padx=10, pady=5, sticky="nsew")
         
-        if self.files_to_process:
-            ttk.Label(file_frame, text=self.files_to_process[0]).grid(row=0, column=0, sticky="w")
-        else:
-            ttk.Label(file_frame, text="No audio files found").grid(row=0, column=0, sticky="w")
+        self.file_label = ttk.Label(file_frame, text="No audio files found")
+        self.file_label.grid(row=0, column=0, sticky="w")
+        
+        # Waveform of the current file, drawn from the peaks cached during analysis
+        self.waveform = WaveformView(file_frame)
+        self.waveform.canvas.grid(row=1, column=0, sticky="ew", pady=(5, 0))
+        file_frame.columnconfigure(0, weight=1)
         
         # Set consistent column widths
         column_widths = [15, 8, 15]  # Width for each column
@@ -108,9 +211,17 @@ class AudioAnalysisGUI:
         ttk.Checkbutton(module2_header, variable=self.module2_enabled).grid(row=0, column=0, padx=(0,5))
         ttk.Label(module2_header, text="Module 2: Stem Separation").grid(row=0, column=1, sticky="w")
         
+        # Stem target selection
+        targets_frame = ttk.Frame(module2_frame)
+        targets_frame.grid(row=1, column=0, padx=5, pady=(5, 0), sticky="w")
+        target_labels = {'other': 'Melody'}
+        for i, target in enumerate(STEM_TARGETS):
+            ttk.Checkbutton(targets_frame, text=target_labels.get(target, target.capitalize()),
+                            variable=self.target_enabled[target]).grid(row=i // 5, column=i % 5, sticky="w", padx=(0, 8))
+        
         # Progress section - reduced vertical spacing
         progress_frame = ttk.Frame(module2_frame)
-        progress_frame.grid(row=1, column=0, padx=5, pady=5, sticky="nsew")  # reduced pady
+        progress_frame.grid(row=2, column=0, padx=5, pady=5, sticky="nsew")  # reduced pady
         
         # Configure progress frame to expand
         module2_frame.columnconfigure(0, weight=1)
@@ -148,147 +259,328 @@ class AudioAnalysisGUI:
         self.root.columnconfigure(0, weight=1)
 
     def analyze_file(self, filename):
+        """Start BPM and key analysis of a file in the background (at most once per file)"""
+        if filename in self.analysis_futures:
+            return
+        file_path = os.path.join(os.getcwd(), filename)
+        self.analysis_futures[filename] = self.analysis_executor.submit(self._analyze_worker, filename, file_path)
+
+    def _analyze_worker(self, filename, file_path):
         try:
-            file_path = os.path.join(os.getcwd(), filename)
-            
-            # BPM Analysis - only DeepRhythm
-            y, sr = librosa.load(file_path)
-            predictor = DeepRhythmPredictor()
-            bpm, confidence = predictor.predict_from_audio(y, sr, include_confidence=True)
-            self.deeprhythm_bpm.set(f"{bpm:.2f}")
-            self.deeprhythm_confidence.set(f"{confidence:.2%}")
-            
-            # Key Analysis
-            key_results = detect_key(file_path)
-            camelot, full_key, key_conf = key_results[0]
-            
-            # Set combined Camelot/Key format
-            self.combined_key.set(f"{camelot}/{full_key}")
-            self.key_confidence.set(f"{key_conf:.2f}%")
-            
+            if self.predictor is None:
+                from deeprhythm import DeepRhythmPredictor
+                self.predictor = DeepRhythmPredictor()
+            analysis = analyze_track(file_path, predictor=self.predictor)
+            self.events.put(('analysis', filename, analysis, None))
         except Exception as e:
-            self.status_label.config(text=f"Error: {str(e)}")
+            self.events.put(('analysis', filename, None, str(e)))
+
+    def show_analysis(self, analysis):
+        # BPM (DeepRhythm) and key analysis
+        self.deeprhythm_bpm.set(f"{analysis['bpm']:.2f}")
+        self.deeprhythm_confidence.set(f"{analysis['bpm_confidence']:.2%}")
+        
+        # Set combined Camelot/Key format
+        self.combined_key.set(f"{analysis['camelot']}/{analysis['full_key']}")
+        self.key_confidence.set(f"{analysis['key_confidence']:.2f}%")
+        
+        if analysis.get('peaks'):
+            from waveform_peaks import PeakPyramid
+            self.waveform.set_pyramid(PeakPyramid(analysis['peaks']))
 
     def process_current_file(self):
+        if self.processing or self.current_file_index >= len(self.files_to_process):
+            return
         try:
-            # Start timing when process button is clicked
-            start_time = time.time()
-            
             current_file = self.files_to_process[self.current_file_index]
             file_path = os.path.join(os.getcwd(), current_file)
             
             # Get BPM and key info
+            if not (self.manual_bpm.get() or self.deeprhythm_bpm.get()) or \
+               not (self.manual_key.get() or self.combined_key.get()):
+                # Retries the analysis if the previous attempt failed
+                self.analyze_file(current_file)
+                self.status_label.config(text="Analysis still running, please wait...")
+                return
             bpm = float(self.manual_bpm.get()) if self.manual_bpm.get() else float(self.deeprhythm_bpm.get())
             camelot_key = self.manual_key.get() if self.manual_key.get() else self.combined_key.get().split('/')[0]
-            
-            # Create the key/BPM prefix
-            prefix = f"{camelot_key}_{bpm:.2f}BPM_"
-            
+            targets = [t for t in STEM_TARGETS if self.target_enabled[t].get()]
+            plan_targets(targets)
+        except Exception as e:
+            self.status_label.config(text=f"Error: {str(e)}")
+            return
+        
+        self.processing = True
+        self.process_button.config(state='disabled')
+        self.process_executor.submit(self._process_worker, current_file, file_path, camelot_key, bpm,
+                                     self.module2_enabled.get(), self.module3_enabled.get(), targets)
+        
+        # Analyze the next file while this one is separating
+        if self.current_file_index + 1 < len(self.files_to_process):
+            self.analyze_file(self.files_to_process[self.current_file_index + 1])
+
+    def _process_worker(self, current_file, file_path, camelot_key, bpm, separate, chop, targets):
+        # Start timing when process button is clicked
+        start_time = time.time()
+        try:
             # Only perform stem separation if Module 2 is enabled
-            if self.module2_enabled.get():
-                self.status_label.config(text="Starting stem separation...")
-                self.root.update()
-                
+            if separate:
                 output_folder = os.path.join(os.getcwd(), 'output', 'stems')
-                os.makedirs(output_folder, exist_ok=True)
-                
-                stem_paths = separate_stems(file_path, output_folder, 
-                                         progress_callback=self.update_progress,
-                                         prefix=prefix)
-                
-                if stem_paths and 'DRUMS' in stem_paths:
-                    self.status_label.config(text="Separating drum components...")
-                    self.root.update()
-                    
-                    base_name = f"{camelot_key}_{bpm:.2f}BPM_{os.path.splitext(current_file)[0]}"
-                    
-                    from step3_2_DrumSeperation import separate_drums
-                    success = separate_drums(stem_paths['DRUMS'], output_folder, camelot_key, bpm, base_name)
-                    
-                    if not success:
-                        self.status_label.config(text="Drum separation failed")
-                        return
-                
-                # Only perform segment chopping if Module 3 is enabled
-                if self.module3_enabled.get():
-                    self.status_label.config(text="Chopping stems into 8-bar segments...")
-                    self.root.update()
-                    
-                    from step4_ChopSegments8Bars import process_stems_to_segments
-                    if process_stems_to_segments(output_folder, self.update_progress):
-                        self.status_label.config(text="Successfully created 8-bar segments!")
-                    else:
-                        self.status_label.config(text="Failed to create segments")
-                        return
                 
-                # After all processing is complete (just before the "Move to next file" section)
-                self.status_label.config(text=f"Completed processing {current_file}")
+                # Module 3 (segment chopping) only runs if it is enabled
+                # Near-duplicates of already processed songs reuse their stems
+                from fingerprint import FingerprintIndex, default_index_path
+                from segment_index import SegmentIndex, default_index_path as default_segment_index_path
+                analysis = self.analysis_results.get(current_file, {})
+                result = process_track(file_path, camelot_key, bpm, output_folder,
+                                       progress_callback=self.update_progress,
+                                       chop=chop,
+                                       fingerprint=analysis.get('fingerprint'),
+                                       duration=analysis.get('duration'),
+                                       dedupe_index=FingerprintIndex(default_index_path()),
+                                       targets=targets,
+                                       segment_index=SegmentIndex(default_segment_index_path()),
+                                       backend=self.backend,
+                                       model_cache=self.model_cache)
+                if result is None:
+                    self.events.put(('done', current_file, None, None))
+                    return
             
             # Calculate and display elapsed time
-            end_time = time.time()
-            elapsed_time = end_time - start_time
+            elapsed_time = time.time() - start_time
             timing_msg = f"\nTotal Processing Time: {elapsed_time:.2f} seconds"
             print("\n" + "=" * 30)
             print(timing_msg)
             print("=" * 30)
-            
-            self.status_label.config(text=f"Complete! Took {elapsed_time:.2f} seconds")
-            
-            # Move to next file if available
-            self.current_file_index += 1
-            if self.current_file_index < len(self.files_to_process):
-                self.analyze_file(self.files_to_process[self.current_file_index])
-            else:
-                self.status_label.config(text="All files processed!")
+            self.events.put(('done', current_file, elapsed_time, None))
             
         except Exception as e:
-            self.status_label.config(text=f"Error: {str(e)}")
+            self.events.put(('done', current_file, None, str(e)))
+
+    def finish_file(self, elapsed_time, error):
+        self.processing = False
+        self.process_button.config(state='normal')
+        
+        if error:
+            self.status_label.config(text=f"Error: {error}")
+            return
+        if elapsed_time is None:
+            # A stage failed, its status message is already shown
+            return
+        
+        self.status_label.config(text=f"Complete! Took {elapsed_time:.2f} seconds")
+        
+        # Move to next file if available
+        self.current_file_index += 1
+        if self.current_file_index < len(self.files_to_process):
+            next_file = self.files_to_process[self.current_file_index]
+            self.file_label.config(text=next_file)
+            for var in (self.deeprhythm_bpm, self.deeprhythm_confidence, self.combined_key, self.key_confidence):
+                var.set("")
+            self.waveform.set_pyramid(None)
+            self.analyze_file(next_file)
+            if next_file in self.analysis_results:
+                self.show_analysis(self.analysis_results[next_file])
+        else:
+            self.status_label.config(text="All files processed!")
 
     def update_progress(self, progress, status_message=None):
         """
-        Update the progress bar and progress label
-        progress: float or string representing progress
+        Thread-safe progress callback, queues the update for the Tk loop
+        progress: float or string representing progress, or None to only update the status
         status_message: optional status message to display
         """
+        self.events.put(('progress', progress, status_message, None))
+
+    def poll_events(self):
+        """
+        Drain the event queue on the Tk thread
+        Bursts of progress updates are coalesced so the widgets redraw at most once per poll
+        """
+        latest_progress = None
+        latest_status = None
         try:
-            # Convert progress to percentage (0-100)
-            if isinstance(progress, str):
-                try:
-                    # Try to extract number from string like "45.5%"
-                    percentage = float(progress.strip('%'))
-                except ValueError:
-                    percentage = 0
-            else:
-                percentage = float(progress)
-            
-            # Ensure percentage is between 0 and 100
-            percentage = max(0, min(100, percentage))
-            
-            # Update progress bar
-            self.progress_bar['value'] = percentage
-            
-            # Update progress label
-            self.progress_label.config(text=f"{percentage:.1f}%")
+            while True:
+                kind, a, b, c = self.events.get_nowait()
+                if kind == 'progress':
+                    if a is not None:
+                        latest_progress = a
+                    if b:
+                        latest_status = b
+                elif kind == 'analysis':
+                    if c is None:
+                        self.analysis_results[a] = b
+                    else:
+                        # Forget the failed attempt so the file can be analyzed again
+                        self.analysis_futures.pop(a, None)
+                    if self.current_file_index < len(self.files_to_process) and \
+                       a == self.files_to_process[self.current_file_index]:
+                        if c is None:
+                            self.show_analysis(b)
+                            if not self.processing:
+                                latest_status = "Ready"
+                        else:
+                            latest_status = f"Error: {c}"
+                elif kind == 'done':
+                    self.apply_progress(latest_progress, latest_status)
+                    latest_progress = latest_status = None
+                    self.finish_file(b, c)
+        except queue.Empty:
+            pass
+        
+        self.apply_progress(latest_progress, latest_status)
+        self.root.after(POLL_INTERVAL_MS, self.poll_events)
+
+    def apply_progress(self, progress, status_message):
+        """Update the progress bar and labels, must be called on the Tk thread"""
+        try:
+            if progress is not None:
+                # Convert progress to percentage (0-100)
+                if isinstance(progress, str):
+                    try:
+                        # Try to extract number from string like "45.5%"
+                        percentage = float(progress.strip('%'))
+                    except ValueError:
+                        percentage = 0
+                else:
+                    percentage = float(progress)
+                
+                # Ensure percentage is between 0 and 100
+                percentage = max(0, min(100, percentage))
+                
+                if percentage != self.current_progress:
+                    self.current_progress = percentage
+                    self.progress_bar['value'] = percentage
+                    self.progress_label.config(text=f"{percentage:.1f}%")
             
             # Update status message if provided
             if status_message:
                 self.status_label.config(text=status_message)
             
-            # Force GUI update
-            self.root.update()
-            
         except Exception as e:
             print(f"Error updating progress: {str(e)}")
             # Don't let progress errors stop the process
             pass
 
+    def on_close(self):
+        # Drop queued work, then close the window
+        self.analysis_executor.shutdown(wait=False, cancel_futures=True)
+        self.process_executor.shutdown(wait=False, cancel_futures=True)
+        self.root.destroy()
+
     def run(self):
         self.root.mainloop()
+        busy = self.processing or any(not f.done() for f in self.analysis_futures.values())
+        if busy:
+            # Executor threads are joined at interpreter exit, which would keep the app alive
+            # until the running separation finished. The Demucs subprocess stops once its
+            # output pipe to this process is gone
+            print("Window closed while processing, stopping")
+            os._exit(1)
+
+def run_headless(manual_bpm=None, manual_key=None, chop=True, on_duplicate='reuse', targets=None,
+                 backend='torch'):
+    """Process every audio file in the current directory without the GUI"""
+    from memory_governor import MemoryGovernor, estimate_file, default_log_path
+    from fingerprint import FingerprintIndex, default_index_path
+    from segment_index import SegmentIndex, default_index_path as default_segment_index_path
+    
+    files = sorted(f for f in os.listdir(os.getcwd()) if f.lower().endswith(AUDIO_EXTENSIONS))
+    if not files:
+        print("No audio files found")
+        return False
+    
+    output_folder = os.path.join(os.getcwd(), 'output', 'stems')
+    dedupe_index = FingerprintIndex(default_index_path()) if on_duplicate != 'off' else None
+    segment_index = SegmentIndex(default_segment_index_path())
+    # Files run one at a time; the governor only logs estimated vs measured peaks here
+    governor = MemoryGovernor(log_path=default_log_path())
+    model_cache = {}  # ONNX models stay loaded from one file to the next
+    all_ok = True
+    bpm_pool = predictor = None
+    if manual_bpm is None and len(files) > 1:
+        from deeprhythm import DeepRhythmPredictor
+        from step1_BPMAnalysis import bpm_worker_pool, detect_bpm_batch
+        # Started once for the whole run: every spawned worker imports torch and DeepRhythm, and
+        # more workers than files per group would sit idle
+        bpm_pool = bpm_worker_pool(min(os.cpu_count() or 1, BPM_GROUP_FILES))
+        predictor = DeepRhythmPredictor()
+    try:
+        for group_start in range(0, len(files), BPM_GROUP_FILES):
+            group = files[group_start:group_start + BPM_GROUP_FILES]
+        
+            # Batched DeepRhythm inference per group of files; the buffers the workers decoded
+            # are reused for key analysis, so every file is decoded once
+            bpm_results, buffers = [None] * len(group), [None] * len(group)
+            if bpm_pool is not None:
+                bpm_results, buffers = detect_bpm_batch([os.path.join(os.getcwd(), f) for f in group],
+                                                        predictor=predictor, return_audio=True, executor=bpm_pool)
+        
+            for i, current_file in enumerate(group):
+                start_time = time.time()
+                file_path = os.path.join(os.getcwd(), current_file)
+                print(f"\nProcessing {current_file}")
+            
+                with governor.admit(file_path, estimate_file(file_path, targets, chop)):
+                    analysis = analyze_track(file_path, bpm_result=bpm_results[i], audio=buffers[i])
+                    buffers[i] = None
+                    bpm = manual_bpm if manual_bpm is not None else analysis['bpm']
+                    camelot_key = manual_key if manual_key else analysis['camelot']
+                
+                    result = process_track(file_path, camelot_key, bpm, output_folder, chop=chop,
+                                           fingerprint=analysis['fingerprint'], duration=analysis['duration'],
+                                           dedupe_index=dedupe_index, on_duplicate=on_duplicate,
+                                           targets=targets, segment_index=segment_index, backend=backend,
+                                           model_cache=model_cache)
+                if result is None:
+                    all_ok = False
+                print(f"\nTotal Processing Time: {time.time() - start_time:.2f} seconds")
+    finally:
+        if bpm_pool is not None:
+            bpm_pool.shutdown()
+    return all_ok
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Split songs in the current folder into stems and 8-bar segments")
+    parser.add_argument('--headless', action='store_true', help="Process all files without opening the GUI")
+    parser.add_argument('--bpm', type=float, default=None, help="Manual BPM override (headless mode)")
+    parser.add_argument('--key', default=None, help="Manual Camelot key override, e.g. 8A (headless mode)")
+    parser.add_argument('--no-chop', action='store_true', help="Skip Module 3 segment chopping (headless mode)")
+    parser.add_argument('--on-duplicate', choices=['reuse', 'skip', 'off'], default='reuse',
+                        help="What to do with songs already processed in another encoding (headless mode)")
+    parser.add_argument('--targets', default=None,
+                        help=f"Comma separated stems to produce (headless mode): {','.join(STEM_TARGETS)}")
+    parser.add_argument('--backend', choices=BACKENDS, default='torch',
+                        help="Separation inference backend")
+    parser.add_argument('--onnx-threads', type=int, default=0,
+                        help="ONNX Runtime intra-op threads (default: one per core)")
+    args = parser.parse_args()
+    targets = args.targets.split(',') if args.targets else None
+    try:
+        plan_targets(targets)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.bpm is not None and not (math.isfinite(args.bpm) and args.bpm > 0):
+        parser.error(f"--bpm must be a positive number, got {args.bpm}")
+    if args.key and not CAMELOT_PATTERN.match(args.key):
+        parser.error(f"--key must be a Camelot key like 8A, got {args.key!r}")
+    if args.backend == 'onnx':
+        from onnx_backend import available
+        if not available():
+            parser.error("--backend onnx needs onnxruntime: pip install onnxruntime")
+    
     print("\n" + "=" * 30)
     print(f"Starting processing at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     print("=" * 30 + "\n")
     
-    gui = AudioAnalysisGUI()
+    if args.onnx_threads:
+        from onnx_backend import set_threads
+        set_threads(args.onnx_threads)
+    
+    if args.headless:
+        sys.exit(0 if run_headless(args.bpm, args.key, chop=not args.no_chop,
+                                  on_duplicate=args.on_duplicate, targets=targets,
+                                  backend=args.backend) else 1)
+    
+    gui = AudioAnalysisGUI(backend=args.backend)
     gui.run()
\ No newline at end of file
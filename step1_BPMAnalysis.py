@@ -1,11 +1,11 @@
-from deeprhythm import DeepRhythmPredictor
-import librosa
+import os
 
 def detect_bpm(y, sr, file_path, start_bpm=None):
     """
     Detect BPM using DeepRhythm
     """
     print("Analyzing BPM...")
+    from deeprhythm import DeepRhythmPredictor
     
     predictor = DeepRhythmPredictor()
     bpm, confidence = predictor.predict_from_audio(y, sr, include_confidence=True)
@@ -19,6 +19,132 @@ def load_and_analyze_bpm(file_path, manual_bpm=None):
     if manual_bpm is not None:
         return manual_bpm
     
-    y, sr = librosa.load(file_path)
+    from audio_decoder import decode
+    y, sr = decode(file_path)
     bpm, confidence = detect_bpm(y, sr, file_path)
-    return bpm
\ No newline at end of file
+    return bpm
+
+# DeepRhythm works on 8 second clips at 22.05 kHz
+DEEPRHYTHM_SR = 22050
+DEEPRHYTHM_CLIP_SECONDS = 8
+
+_worker_specs = None
+
+def _init_bpm_worker():
+    """Build the HCQM kernels once per worker process"""
+    global _worker_specs
+    import torch
+    from deeprhythm.audio_proc.hcqm import make_kernels
+
+    # Workers already run in parallel, one thread each avoids oversubscribing the CPU
+    torch.set_num_threads(1)
+    _worker_specs = make_kernels(DEEPRHYTHM_SR * DEEPRHYTHM_CLIP_SECONDS, DEEPRHYTHM_SR, device='cpu')
+
+def _bpm_features(item, return_audio=False):
+    """
+    Decode (if needed), split and compute the DeepRhythm HCQM input features of one track
+    item: file path or (y, sr) tuple
+    Returns a numpy array of shape (clips, bins, bands, harmonics), or None if the track is too short
+    With return_audio, returns (features, (y, sr)) so the caller can reuse the decoded buffer
+    """
+    import librosa
+    from audio_decoder import decode
+    from deeprhythm.utils import split_audio
+    from deeprhythm.audio_proc.hcqm import compute_hcqm
+
+    features, audio = None, None
+    try:
+        if isinstance(item, str):
+            y, sr = decode(item, sr=DEEPRHYTHM_SR)
+            audio = (y, sr)
+        else:
+            y, sr = item
+            if sr != DEEPRHYTHM_SR:
+                y = librosa.resample(y, orig_sr=sr, target_sr=DEEPRHYTHM_SR)
+
+        clips = split_audio(y, DEEPRHYTHM_SR, clip_length=DEEPRHYTHM_CLIP_SECONDS)
+        if clips is not None:
+            features = compute_hcqm(clips, *_worker_specs).numpy()
+    except Exception as e:
+        name = item if isinstance(item, str) else 'buffer'
+        print(f"Error computing BPM features for {name}: {e}")
+    return (features, audio) if return_audio else features
+
+def bpm_worker_pool(workers=None):
+    """
+    Process pool for detect_bpm_batch's feature extraction, reuse it across calls: every worker
+    is a fresh interpreter that imports torch, librosa and DeepRhythm and builds its kernels
+    Torch and the predictor are usually loaded in the parent already; forked children can
+    deadlock on the inherited OpenMP/MKL thread pools, spawned ones start from a clean interpreter
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    workers = workers or os.cpu_count() or 1
+    print(f"Starting {workers} BPM feature worker(s)...")
+    return ProcessPoolExecutor(max_workers=workers, initializer=_init_bpm_worker,
+                               mp_context=multiprocessing.get_context('spawn'))
+
+def detect_bpm_batch(items, workers=None, batch_size=128, predictor=None, return_audio=False, executor=None):
+    """
+    Detect the BPM of many tracks with batched DeepRhythm inference
+    Input features are computed in parallel worker processes, clips of several tracks are
+    then stacked into batches of up to batch_size clips for each model forward pass
+    Pass an executor from bpm_worker_pool when calling this repeatedly; without one, a pool of
+    `workers` processes is started and shut down for this call
+    items: list of file paths or (y, sr) tuples
+    Returns a list of (bpm, confidence) in input order, None for tracks that failed or are
+    shorter than one clip
+    With return_audio, returns (results, buffers) where buffers holds the (y, sr) each worker
+    decoded from a file path (22.05 kHz mono, as analyze_track decodes), None otherwise
+    """
+    import numpy as np
+    import torch
+    from functools import partial
+    from deeprhythm import DeepRhythmPredictor
+    from deeprhythm.utils import class_to_bpm
+
+    if predictor is None:
+        predictor = DeepRhythmPredictor()
+
+    results = [None] * len(items)
+    buffers = [None] * len(items)
+    pending_features = []  # (item index, features)
+    pending_clips = 0
+
+    def run_batch():
+        batch = torch.from_numpy(np.concatenate([f for _, f in pending_features]))
+        with torch.no_grad():
+            outputs = predictor.model(batch.permute(0, 3, 1, 2).to(device=predictor.device))
+            probabilities = torch.softmax(outputs, dim=1)
+
+        start = 0
+        for index, features in pending_features:
+            mean_probabilities = probabilities[start:start + len(features)].mean(dim=0)
+            confidence, predicted_class = torch.max(mean_probabilities, 0)
+            results[index] = (class_to_bpm(predicted_class.item()), confidence.item())
+            start += len(features)
+
+    own_executor = executor is None
+    if own_executor:
+        executor = bpm_worker_pool(workers)
+    print(f"Analyzing BPM of {len(items)} tracks (batches of {batch_size} clips)...")
+    try:
+        # map keeps input order and overlaps feature extraction with inference
+        extract = partial(_bpm_features, return_audio=return_audio)
+        for index, output in enumerate(executor.map(extract, items)):
+            features, buffers[index] = output if return_audio else (output, None)
+            if features is None:
+                continue
+            pending_features.append((index, features))
+            pending_clips += len(features)
+            if pending_clips >= batch_size:
+                run_batch()
+                pending_features, pending_clips = [], 0
+        if pending_features:
+            run_batch()
+    finally:
+        if own_executor:
+            executor.shutdown()
+
+    return (results, buffers) if return_audio else results
@@ -1,14 +1,17 @@
-import librosa
 import numpy as np
 import os
 import shutil
 
-def detect_key(file_path):
+def detect_key(file_path, y=None, sr=None):
     """
     Detect musical key using librosa's key detection
+    Pass an already decoded mono buffer as y/sr to skip decoding the file again
     """
     print("Analyzing Key...")
-    y, sr = librosa.load(file_path)
+    import librosa
+    if y is None:
+        from audio_decoder import decode
+        y, sr = decode(file_path)
     
     # Compute chromagram
     chroma = librosa.feature.chroma_cqt(y=y, sr=sr)
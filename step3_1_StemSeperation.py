@@ -4,13 +4,15 @@ from pathlib import Path
 import shutil
 import re
 from concurrent.futures import ThreadPoolExecutor
-import torch
 import soundfile as sf
-import resampy
 
-def separate_stems(input_file, output_folder, progress_callback=None, prefix='', device='cpu', stems=None):
+def separate_stems(input_file, output_folder, progress_callback=None, prefix='', device='cpu', stems=None,
+                   two_stems=None, backend='torch', model_cache=None):
     """
     Separates audio into stems using Demucs v4
+    two_stems='vocals' only writes vocals and the rest mixed together, saved as 'instrumental'
+    backend='onnx' runs the model with ONNX Runtime on the CPU instead of the demucs CLI,
+    keeping it loaded in model_cache (a dict the caller reuses) between tracks
     """
     try:
         # Ensure paths are strings and absolute
@@ -24,44 +26,52 @@ def separate_stems(input_file, output_folder, progress_callback=None, prefix='',
         # Create output directory if it doesn't exist
         os.makedirs(output_folder, exist_ok=True)
         
-        # Build demucs command
-        demucs_cmd = [
-            'demucs',
-            '-n', 'htdemucs',
-            '--out', output_folder,
-            '--device', device
-        ]
-        
-        # Add stems parameter if specified
-        if stems:
-            demucs_cmd.extend(['--stems', '+'.join(stems)])
-        
-        # Add input file
-        demucs_cmd.append(input_file)
-        
-        print(f"Running command: {' '.join(demucs_cmd)}")
-        
-        process = subprocess.Popen(
-            demucs_cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            universal_newlines=True
-        )
-        
-        # Monitor the output
-        while True:
-            line = process.stderr.readline()
-            if not line and process.poll() is not None:
-                break
+        if backend == 'onnx':
+            from onnx_backend import separate_file
+            print("Running htdemucs with ONNX Runtime")
+            separate_file(input_file, output_folder, 'htdemucs', two_stems=two_stems,
+                          progress_callback=progress_callback, cache=model_cache)
+        else:
+            # Build demucs command
+            demucs_cmd = [
+                'demucs',
+                '-n', 'htdemucs',
+                '--out', output_folder,
+                '--device', device
+            ]
+        
+            # Add stems parameter if specified
+            if stems:
+                demucs_cmd.extend(['--stems', '+'.join(stems)])
+            if two_stems:
+                demucs_cmd.extend(['--two-stems', two_stems])
+        
+            # Add input file
+            demucs_cmd.append(input_file)
+        
+            print(f"Running command: {' '.join(demucs_cmd)}")
+        
+            process = subprocess.Popen(
+                demucs_cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                universal_newlines=True
+            )
+        
+            # Monitor the output
+            while True:
+                line = process.stderr.readline()
+                if not line and process.poll() is not None:
+                    break
                 
-            # Parse progress from demucs output
-            if "%" in line:
-                try:
-                    progress = float(line.split("%")[0].strip())
-                    if progress_callback:
-                        progress_callback(progress, f"Separating stems: {progress:.1f}%")
-                except ValueError:
-                    pass
+                # Parse progress from demucs output
+                if "%" in line:
+                    try:
+                        progress = float(line.split("%")[0].strip())
+                        if progress_callback:
+                            progress_callback(progress, f"Separating stems: {progress:.1f}%")
+                    except ValueError:
+                        pass
         
         # Get the base name without any existing prefix
         input_filename = Path(input_file).stem
@@ -76,6 +86,8 @@ def separate_stems(input_file, output_folder, progress_callback=None, prefix='',
             for stem_file in os.listdir(temp_stem_folder):
                 if stem_file.endswith('.wav'):
                     stem_type = stem_file.split('.')[0]  # drums, bass, vocals, other
+                    if stem_type == 'no_vocals':
+                        stem_type = 'instrumental'
                     old_path = os.path.join(temp_stem_folder, stem_file)
                     
                     # Use the provided prefix for the new filename
@@ -108,6 +120,8 @@ def separate_stems_multi_gpu(input_files, output_folder, num_gpus=2):
     """
     Process multiple files in parallel using multiple GPUs
     """
+    import torch
+
     def process_on_gpu(file_data):
         file_path, gpu_id = file_data
         torch.cuda.set_device(gpu_id)
@@ -125,6 +139,8 @@ def optimize_audio_for_separation(input_file):
     """
     Optimize audio file before separation
     """
+    import resampy
+
     # Load audio
     y, sr = sf.read(input_file)
     
@@ -146,6 +162,8 @@ def verify_gpu_setup():
     """
     Verify GPU setup and print diagnostics
     """
+    import torch
+
     print("\nChecking GPU setup...")
     if torch.cuda.is_available():
         print(f"GPU available: {torch.cuda.get_device_name(0)}")
@@ -2,14 +2,21 @@ import os
 import subprocess
 from pathlib import Path
 import soundfile as sf
-import librosa
 import numpy as np
 import shutil
 import time
+from silence_gate import is_silent
 
-def separate_drums(drum_stem_path, output_folder, camelot_key, bpm, base_name):
+def separate_drums(drum_stem_path, output_folder, camelot_key, bpm, base_name, summary=None, parts=None,
+                   writer=None, backend='torch', model_cache=None):
     """
     Separates a drum stem into kick, snare, cymbals, and toms
+    parts limits which components are written, e.g. ['kick', 'snare'] (default: all four)
+    A drum stem below the silence gate is not sent through drumsep; the levels are
+    recorded in summary['skipped_drumsep'] and the call still counts as successful
+    With a WriteBehindQueue the parts are written in the background; flush it before reading them
+    backend='onnx' runs the drumsep model with ONNX Runtime instead of the drumsep script,
+    keeping it loaded in model_cache (a dict the caller reuses) between tracks
     Returns True if successful, False otherwise
     """
     try:
@@ -18,7 +25,7 @@ def separate_drums(drum_stem_path, output_folder, camelot_key, bpm, base_name):
         print(f"Output folder: {output_folder}")
         
         # Create temporary output directory for drum separation
-        drums_output = os.path.join(output_folder, 'drum_parts_temp')
+        drums_output = os.path.abspath(os.path.join(output_folder, 'drum_parts_temp'))
         os.makedirs(drums_output, exist_ok=True)
         
         # Debug prints for path resolution
@@ -37,6 +44,8 @@ def separate_drums(drum_stem_path, output_folder, camelot_key, bpm, base_name):
         # Make script executable
         os.chmod(drumsep_script, 0o755)
         
+        import librosa
+        
         # Get original audio info before processing
         y_orig, sr_orig = librosa.load(drum_stem_path, sr=None, mono=False)  # Load as stereo
         orig_len = y_orig.shape[1] if len(y_orig.shape) > 1 else len(y_orig)
@@ -47,29 +56,44 @@ def separate_drums(drum_stem_path, output_folder, camelot_key, bpm, base_name):
         print(f"Duration: {orig_duration:.2f} seconds")
         print(f"Total samples: {orig_len}")
         
-        # Store original directory and change to drumsep directory
-        original_dir = os.getcwd()
-        os.chdir(drumsep_dir)
+        # librosa loads stereo as (channels, samples), the gate expects samples first
+        silent, rms_db, peak_db = is_silent(y_orig.T)
+        if silent:
+            print(f"\nDrum stem is silent (RMS {rms_db:.1f} dBFS, peak {peak_db:.1f} dBFS), skipping drumsep")
+            if summary is not None:
+                summary['skipped_drumsep'] = {
+                    'stem': drum_stem_path,
+                    'rms_db': rms_db,
+                    'peak_db': peak_db
+                }
+            shutil.rmtree(drums_output, ignore_errors=True)
+            return True
         
-        try:
+        start_time = time.time()
+        if backend == 'onnx':
+            # Same model and output layout as the script, in-process with ONNX Runtime
+            from onnx_backend import separate_file
+            print("\nStarting drum separation with ONNX Runtime...")
+            separate_file(drum_stem_path, drums_output, '49469ca8', repo=os.path.join(drumsep_dir, 'model'),
+                          cache=model_cache)
+            print(f"Separation completed in {time.time() - start_time:.2f} seconds")
+        else:
             print("\nStarting drum separation subprocess...")
-            start_time = time.time()
             
-            # Run the separation using the bash script directly on the drum stem
+            # Run the separation using the bash script directly on the drum stem.
+            # The script resolves its model repo relative to the drumsep directory, so run it
+            # there via cwd rather than os.chdir, which would race with other worker threads
             process = subprocess.run([
                 'bash',
                 drumsep_script,
                 drum_stem_path,
                 drums_output
-            ], check=True, capture_output=True, text=True)
+            ], check=True, capture_output=True, text=True, cwd=drumsep_dir)
             
             print(f"Separation completed in {time.time() - start_time:.2f} seconds")
             if process.stderr:
                 print("Subprocess stderr output:")
                 print(process.stderr)
-            
-        finally:
-            os.chdir(original_dir)
         
         # Find the output directory (should be under the model name)
         model_output = os.path.join(drums_output, '49469ca8')
@@ -94,6 +118,8 @@ def separate_drums(drum_stem_path, output_folder, camelot_key, bpm, base_name):
         print("\nProcessing individual components:")
         # Process each component
         for old_name, new_type in drum_parts.items():
+            if parts is not None and new_type not in parts:
+                continue
             old_path = os.path.join(parts_folder, f"{old_name}.wav")
             if os.path.exists(old_path):
                 print(f"\nProcessing {new_type}:")
@@ -124,9 +150,10 @@ def separate_drums(drum_stem_path, output_folder, camelot_key, bpm, base_name):
                 orig_info = sf.info(drum_stem_path)  # Get original file info
                 
                 # Save with original format and stereo channels
-                sf.write(new_path, y.T, sr, 
-                         subtype=orig_info.subtype,
-                         format=orig_info.format)
+                (writer.write if writer is not None else sf.write)(
+                    new_path, y.T, sr,
+                    subtype=orig_info.subtype,
+                    format=orig_info.format)
                 print(f"  Saved WAV file: {new_path}")
         
         # Clean up temporary files
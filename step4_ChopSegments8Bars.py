@@ -1,8 +1,7 @@
 import os
-from pydub import AudioSegment
 import re
-import librosa
 import soundfile as sf
+from silence_gate import segment_levels, silent_mask, RMS_THRESHOLD_DB, PEAK_THRESHOLD_DB
 
 def calculate_bar_length_ms(bpm):
     """Calculate length of one bar in milliseconds"""
@@ -17,6 +16,19 @@ def extract_bpm_from_filename(filename):
         return float(match.group(1))
     raise ValueError(f"Could not extract BPM from filename: {filename}")
 
+def extract_key_from_filename(filename):
+    """Extract the Camelot key from a filename like '10A_121.00BPM_...', None if there is none"""
+    match = re.match(r'(?:B\d+_)?((?:1[0-2]|[1-9])[AB])_', filename)
+    return match.group(1) if match else None
+
+def extract_stem_type_from_filename(filename):
+    """
+    Extract the stem type from a stem or segment name like '8A_121.00BPM_song_drum_kick.wav'
+    Returns e.g. 'vocals' or 'drum_kick', or None if the name has no known stem suffix
+    """
+    match = re.search(r'_(drum_(?:kick|snare|cymbals|toms)|vocals|bass|other|drums|instrumental)\.wav$', filename)
+    return match.group(1) if match else None
+
 def calculate_samples_per_bar(bpm, sample_rate):
     """Calculate exact number of samples for one bar"""
     beats_per_bar = 4  # 4/4 time
@@ -25,16 +37,31 @@ def calculate_samples_per_bar(bpm, sample_rate):
     # Use round instead of int for better accuracy
     return round(samples_per_bar)
 
-def chop_stems_to_segments(stems_folder, crossfade_samples=0):
+def chop_stems_to_segments(stems_folder, crossfade_samples=0, skip_silent=True,
+                           rms_threshold_db=RMS_THRESHOLD_DB, peak_threshold_db=PEAK_THRESHOLD_DB,
+                           summary=None, name_prefix='', stem_types=None, index=None, writer=None):
     """
     Chop stems into precise 8-bar segments based on sample count
+    Segments below both the RMS and peak thresholds are not written when skip_silent is set;
+    their starting bars are recorded per stem file in summary['skipped_segments']
+    name_prefix and stem_types restrict chopping to one track's files and to selected stems
+    With a SegmentIndex, per-segment features are computed from the loaded stem and stored
+    together with BPM, Camelot key, stem type and bar number
+    With a WriteBehindQueue, segments are handed to its writer threads instead of written
+    inline; the caller flushes it
     Returns: Total number of segments created
     """
+    if summary is None:
+        summary = {}
+    skipped_segments = summary.setdefault('skipped_segments', {})
+    save = writer.write if writer is not None else sf.write
     segments_folder = os.path.join(stems_folder, 'segments')
     os.makedirs(segments_folder, exist_ok=True)
     
     stem_files = [f for f in os.listdir(stems_folder) 
-                 if f.endswith('.wav') and os.path.isfile(os.path.join(stems_folder, f))]
+                 if f.endswith('.wav') and os.path.isfile(os.path.join(stems_folder, f))
+                 and f.startswith(name_prefix)
+                 and (stem_types is None or extract_stem_type_from_filename(f) in stem_types)]
     
     if not stem_files:
         print("No WAV files found in stems folder")
@@ -62,8 +89,9 @@ def chop_stems_to_segments(stems_folder, crossfade_samples=0):
     for stem_file in stem_files:
         try:
             input_path = os.path.join(stems_folder, stem_file)
-            # Load audio maintaining ALL original properties
-            y, sr = sf.read(input_path)
+            # Load audio maintaining ALL original properties; float32 holds 16/24-bit
+            # samples exactly at half the memory of float64
+            y, sr = sf.read(input_path, dtype='float32')
             
             # Verify sample rate matches reference
             if sr != info.samplerate:
@@ -73,44 +101,96 @@ def chop_stems_to_segments(stems_folder, crossfade_samples=0):
             num_segments = len(y) // samples_per_8bars
             file_segments = 0  # Track segments for this file
             
+            features = None
+            if index is not None:
+                from segment_index import compute_segment_features
+                features = compute_segment_features(y, sr, samples_per_8bars)
+            index_rows = []
+            
+            # Gate every segment of the stem at once instead of per write
+            if skip_silent:
+                if features is not None:
+                    rms_db, peak_db = features['rms_db'], features['peak_db']
+                else:
+                    rms_db, peak_db = segment_levels(y, samples_per_8bars)
+                silent = silent_mask(rms_db, peak_db, rms_threshold_db, peak_threshold_db)
+            else:
+                silent = [False] * num_segments
+            
             for i in range(num_segments):
+                # Calculate actual starting bar number (1, 9, 17, etc.)
+                starting_bar = (i * 8) + 1
+                
+                if silent[i]:
+                    skipped_segments.setdefault(stem_file, []).append(starting_bar)
+                    continue
+                
                 start_sample = i * samples_per_8bars
                 end_sample = start_sample + samples_per_8bars
                 
                 segment = y[start_sample:end_sample]
                 
-                # Calculate actual starting bar number (1, 9, 17, etc.)
-                starting_bar = (i * 8) + 1
-                
                 # Save with bar number indicating actual starting position
                 output_path = os.path.join(segments_folder, f"B{starting_bar}_{stem_file}")
-                sf.write(output_path, segment, sr, 
-                        subtype=info.subtype,
-                        format=info.format)
+                save(output_path, segment, sr,
+                     subtype=info.subtype,
+                     format=info.format)
+                
+                if features is not None:
+                    index_rows.append({
+                        'path': output_path,
+                        'source': stem_file,
+                        'stem': extract_stem_type_from_filename(stem_file),
+                        'bar': starting_bar,
+                        'bpm': bpm,
+                        'camelot': extract_key_from_filename(stem_file),
+                        'rms_db': float(features['rms_db'][i]),
+                        'peak_db': float(features['peak_db'][i]),
+                        'onset_density': float(features['onset_density'][i]),
+                        'spectral_centroid': float(features['spectral_centroid'][i])
+                    })
                 
                 file_segments += 1
                 total_segments += 1
                 
-            print(f"Created {file_segments} segments for {stem_file}")
+            if index_rows:
+                index.add_segments(index_rows)
+            
+            num_skipped = len(skipped_segments.get(stem_file, []))
+            if num_skipped:
+                print(f"Created {file_segments} segments for {stem_file} ({num_skipped} silent skipped)")
+            else:
+                print(f"Created {file_segments} segments for {stem_file}")
             
         except Exception as e:
             print(f"Error processing {stem_file}: {e}")
             continue
     
+    total_skipped = sum(len(bars) for bars in skipped_segments.values())
     print(f"\nTotal segments created across all files: {total_segments}")
+    if total_skipped:
+        print(f"Silent segments skipped: {total_skipped}")
     return total_segments  # Return the total count
 
-def process_stems_to_segments(stems_dir, progress_callback=None):
+def process_stems_to_segments(stems_dir, progress_callback=None, summary=None, name_prefix='', stem_types=None,
+                              index=None, writer=None):
     """
     Main function to process stems into segments
     Returns: True if successful, False otherwise
     """
     try:
         print("\nStarting stem segmentation...")
-        num_segments = chop_stems_to_segments(stems_dir)
+        if summary is None:
+            summary = {}
+        num_segments = chop_stems_to_segments(stems_dir, summary=summary,
+                                              name_prefix=name_prefix, stem_types=stem_types,
+                                              index=index, writer=writer)
         if num_segments > 0:
             print(f"\nSuccessfully created {num_segments} segments!")
             return True
+        elif summary.get('skipped_segments'):
+            print("\nAll segments were silent, nothing to write.")
+            return True
         else:
             print("\nNo segments were created.")
             return False
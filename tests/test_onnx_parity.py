@@ -0,0 +1,57 @@
+from fractions import Fraction
+
+import pytest
+
+torch = pytest.importorskip('torch')
+pytest.importorskip('demucs')
+pytest.importorskip('onnxruntime')
+
+import onnx_backend
+
+def save_model(model, path):
+    from omegaconf import OmegaConf
+    from demucs.states import serialize_model
+    torch.save(serialize_model(model, OmegaConf.create({}), half=False), path)
+
+def tiny_models():
+    """
+    Randomly initialised models of the same classes as htdemucs (HTDemucs, loaded through a
+    bag of models) and the drumsep model (HDemucs), small enough to export in seconds
+    """
+    from demucs.htdemucs import HTDemucs
+    from demucs.hdemucs import HDemucs
+
+    torch.manual_seed(0)
+    # The transformer covers the attention layers CoreGraph reroutes, the LocalState layers
+    # in the deepest HDemucs layers the bool torch.eye patch in _export
+    return {
+        'htdemucs': HTDemucs(sources=['drums', 'bass', 'other', 'vocals'], channels=8, depth=4,
+                             segment=Fraction(1), t_layers=1),
+        '49469ca8': HDemucs(sources=['kick', 'snare', 'cymbals', 'toms'], channels=8, segment=1),
+    }
+
+@pytest.fixture
+def repo(tmp_path, monkeypatch):
+    monkeypatch.setattr(onnx_backend, 'CACHE_DIR', str(tmp_path / 'onnx'))
+    models = tiny_models()
+    save_model(models['htdemucs'], tmp_path / 'a1b2c3d4.th')
+    (tmp_path / 'htdemucs.yaml').write_text("models: ['a1b2c3d4']\n")
+    save_model(models['49469ca8'], tmp_path / '49469ca8.th')
+    return str(tmp_path)
+
+@pytest.mark.parametrize('name', ['htdemucs', '49469ca8'])
+def test_onnx_matches_torch_on_one_chunk(repo, name):
+    errors = onnx_backend.check_parity(name, repo)
+    assert errors and max(errors) <= onnx_backend.PARITY_TOLERANCE
+
+@pytest.mark.parametrize('name', ['htdemucs', '49469ca8'])
+def test_onnx_matches_torch_on_a_track(repo, name):
+    from demucs.apply import apply_model
+
+    torch.manual_seed(1)
+    # 2.6 chunks: the last one is shorter than the exported length
+    wav = 0.1 * torch.randn(1, 2, int(44100 * 2.6))
+    with torch.no_grad():
+        expected = apply_model(onnx_backend.load_model(name, repo), wav, shifts=0, split=True, overlap=0.25)
+        actual = apply_model(onnx_backend.onnx_model(name, repo), wav, shifts=0, split=True, overlap=0.25)
+    assert (expected - actual).abs().max().item() <= onnx_backend.PARITY_TOLERANCE
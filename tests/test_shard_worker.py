@@ -0,0 +1,67 @@
+import os
+import threading
+import time
+
+import pipeline
+from shard_worker import DONE_DIR, ShardWorker, read_json
+
+def stub_pipeline(monkeypatch):
+    """Replace analysis and separation with stand-ins that write one stem per track"""
+    def analyze_track(file_path, predictor=None, peaks_dir=None):
+        return {'bpm': 120.0, 'camelot': '8A', 'fingerprint': None}
+
+    def process_track(file_path, camelot_key, bpm, output_folder, chop=True, targets=None, backend='torch'):
+        os.makedirs(output_folder, exist_ok=True)
+        stem = os.path.join(output_folder, f"{os.path.basename(file_path)}_vocals.wav")
+        with open(stem, 'w') as f:
+            f.write(file_path)
+        # Long enough for both workers to have a track in flight at the same time
+        time.sleep(0.2)
+        return {'stems': [stem], 'segments': []}
+
+    monkeypatch.setattr(pipeline, 'analyze_track', analyze_track)
+    monkeypatch.setattr(pipeline, 'process_track', process_track)
+
+def make_worker(inbox, output, worker_id):
+    worker = ShardWorker(inbox, output, worker_id, lease_seconds=30, poll_seconds=0.05)
+    worker.predictor = object()
+    return worker
+
+def test_two_workers_keep_results_of_same_named_tracks(tmp_path, monkeypatch):
+    stub_pipeline(monkeypatch)
+    inbox, output = tmp_path / 'inbox', tmp_path / 'output'
+    inbox.mkdir()
+    tracks = ['song.mp3', 'song.wav', 'song-remix.wav']
+    for track in tracks:
+        (inbox / track).write_bytes(b'audio')
+
+    workers = [make_worker(str(inbox), str(output), f"w{i}") for i in range(2)]
+    threads = [threading.Thread(target=worker.run) for worker in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=30)
+
+    for track in tracks:
+        marker = read_json(os.path.join(inbox, DONE_DIR, f"{track}.json"))
+        assert marker is not None, track
+        assert os.path.basename(marker['output']).startswith(f"{track}@")
+        for stem in marker['stems']:
+            with open(stem) as f:
+                assert f.read() == os.path.join(inbox, track)
+    assert not [entry for entry in os.listdir(output) if entry.startswith('.tmp-')]
+
+def test_leftover_cleanup_only_touches_the_same_track(tmp_path, monkeypatch):
+    stub_pipeline(monkeypatch)
+    inbox, output = tmp_path / 'inbox', tmp_path / 'output'
+    inbox.mkdir()
+    (inbox / 'song.wav').write_bytes(b'audio')
+    leftover = output / f".tmp-song.wav-{'a' * 32}"
+    other_build = output / f".tmp-song-remix.wav-{'b' * 32}"
+    leftover.mkdir(parents=True)
+    other_build.mkdir()
+
+    make_worker(str(inbox), str(output), 'w0').run()
+
+    assert not leftover.exists()
+    assert other_build.exists()
@@ -0,0 +1,163 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+# Finest level: min/max of every 32 samples (~1.5 ms at 22.05 kHz); every level above is
+# 4x coarser, down to a few hundred bins for the whole track
+BASE_BLOCK = 32
+LEVEL_FACTOR = 4
+MIN_BINS = 256
+
+def build_peak_pyramid(y, base_block=BASE_BLOCK, factor=LEVEL_FACTOR, min_bins=MIN_BINS):
+    """
+    Min/max peak pyramid of a mono buffer
+    Only the finest level reads the full-rate buffer (one reshape + min/max pass); every
+    coarser level is reduced from the level below it
+    Returns a list of (block_size, peaks) from fine to coarse, peaks is float16 (bins, 2) of min, max
+    """
+    if len(y) == 0:
+        return [(base_block, np.zeros((0, 2), dtype=np.float16))]
+
+    # Reshaping the full blocks is a view, the buffer is not copied
+    full = len(y) // base_block
+    blocks = y[:full * base_block].reshape(full, base_block)
+    peaks = np.stack([blocks.min(axis=1), blocks.max(axis=1)], axis=1)
+    if len(y) > full * base_block:
+        tail = y[full * base_block:]
+        peaks = np.concatenate([peaks, [[tail.min(), tail.max()]]])
+
+    levels = [(base_block, peaks)]
+    block = base_block
+    while len(peaks) > min_bins:
+        # Pad with the last bin so every group has `factor` entries
+        groups = -(-len(peaks) // factor)
+        peaks = np.concatenate([peaks, np.repeat(peaks[-1:], groups * factor - len(peaks), axis=0)])
+        grouped = peaks.reshape(groups, factor, 2)
+        peaks = np.stack([grouped[:, :, 0].min(axis=1), grouped[:, :, 1].max(axis=1)], axis=1)
+        block *= factor
+        levels.append((block, peaks))
+
+    return [(block, level.astype(np.float16)) for block, level in levels]
+
+def cache_key(file_path):
+    """Identify a file by path, size and modification time, so edited files get new peaks"""
+    stat = os.stat(file_path)
+    digest = hashlib.sha1(f"{os.path.abspath(file_path)}|{stat.st_size}|{stat.st_mtime_ns}".encode()).hexdigest()
+    return f"{os.path.splitext(os.path.basename(file_path))[0]}-{digest[:12]}"
+
+def default_cache_dir():
+    return os.path.join(os.getcwd(), 'output', 'analysis')
+
+def _read_index(index_path):
+    try:
+        with open(index_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def find_cached_peaks(file_path, cache_dir=None):
+    """
+    Index path of the cached pyramid of file_path if the file is unchanged since it was built
+    (same path, size and modification time), None otherwise
+    """
+    cache_dir = cache_dir or default_cache_dir()
+    index_path = os.path.join(cache_dir, f"{cache_key(file_path)}.peaks.json")
+    meta = _read_index(index_path)
+    if meta is None:
+        return None
+    stat = os.stat(file_path)
+    if (meta.get('source') != os.path.abspath(file_path) or meta.get('size') != stat.st_size
+            or meta.get('mtime_ns') != stat.st_mtime_ns or not os.path.exists(index_path[:-len('.json')] + '.npy')):
+        return None
+    return index_path
+
+def remove_stale_peaks(file_path, cache_dir=None):
+    """Delete cached pyramids of earlier versions of file_path and of files that no longer exist"""
+    cache_dir = cache_dir or default_cache_dir()
+    current = f"{cache_key(file_path)}.peaks.json"
+    source = os.path.abspath(file_path)
+    for entry in os.listdir(cache_dir):
+        if not entry.endswith('.peaks.json') or entry == current:
+            continue
+        meta = _read_index(os.path.join(cache_dir, entry))
+        if meta is None or (meta.get('source') != source and os.path.exists(meta.get('source', ''))):
+            continue
+        for suffix in ('.json', '.npy'):
+            try:
+                os.remove(os.path.join(cache_dir, entry[:-len('.json')] + suffix))
+            except FileNotFoundError:
+                pass
+
+def save_peak_pyramid(levels, sr, num_samples, file_path, cache_dir=None):
+    """
+    Cache a pyramid as <key>.peaks.npy (all levels stacked) plus a <key>.peaks.json index,
+    replacing the cache of earlier versions of the file
+    Returns the path of the .json index
+    """
+    cache_dir = cache_dir or default_cache_dir()
+    os.makedirs(cache_dir, exist_ok=True)
+    base = os.path.join(cache_dir, f"{cache_key(file_path)}.peaks")
+
+    meta_levels, offset = [], 0
+    for block, peaks in levels:
+        meta_levels.append({'block': block, 'offset': offset, 'bins': len(peaks)})
+        offset += len(peaks)
+    stat = os.stat(file_path)
+
+    # The index is written last, so an index on disk always has its complete data file
+    tmp_path = f"{base}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.save(f, np.concatenate([peaks for _, peaks in levels]))
+    os.replace(tmp_path, f"{base}.npy")
+    with open(tmp_path, 'w') as f:
+        json.dump({'source': os.path.abspath(file_path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                   'sr': sr, 'num_samples': num_samples, 'levels': meta_levels}, f, indent=2)
+    os.replace(tmp_path, f"{base}.json")
+
+    remove_stale_peaks(file_path, cache_dir)
+    return f"{base}.json"
+
+class PeakPyramid:
+    """
+    Cached peak pyramid opened memory-mapped, so only the bins of the visible range are read
+    and drawing any zoom level costs memory proportional to the view width
+    """
+
+    def __init__(self, index_path):
+        with open(index_path) as f:
+            meta = json.load(f)
+        self.sr = meta['sr']
+        self.num_samples = meta['num_samples']
+        self.levels = meta['levels']
+        self.data = np.load(index_path[:-len('.json')] + '.npy', mmap_mode='r')
+
+    @property
+    def duration(self):
+        return self.num_samples / self.sr
+
+    def view(self, start_sample, end_sample, width):
+        """
+        Min/max per pixel column for samples [start_sample, end_sample) drawn width pixels wide
+        Uses the coarsest level that still has at least one bin per pixel
+        Returns (mins, maxs) float32 arrays of length <= width
+        """
+        start_sample = max(0, int(start_sample))
+        end_sample = min(self.num_samples, int(end_sample))
+        if end_sample <= start_sample or width <= 0:
+            return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.float32)
+
+        samples_per_pixel = (end_sample - start_sample) / width
+        level = self.levels[0]
+        for candidate in self.levels:
+            if candidate['block'] <= samples_per_pixel:
+                level = candidate
+
+        first = start_sample // level['block']
+        last = min(-(-end_sample // level['block']), level['bins'])
+        peaks = np.asarray(self.data[level['offset'] + first:level['offset'] + last], dtype=np.float32)
+
+        # Group the level's bins into pixel columns
+        columns = min(width, len(peaks))
+        edges = np.linspace(0, len(peaks), columns + 1).astype(int)[:-1]
+        return np.minimum.reduceat(peaks[:, 0], edges), np.maximum.reduceat(peaks[:, 1], edges)
@@ -0,0 +1,91 @@
+import os
+import time
+import uuid
+import queue
+import threading
+import soundfile as sf
+
+class WriteBehindQueue:
+    """
+    Bounded queue of audio file writes served by a small pool of writer threads
+    write() returns as soon as the buffer is queued, so computing the next segment overlaps
+    with flushing the previous one to disk. When max_pending writes are waiting, write()
+    blocks until a writer catches up, which caps the memory held by queued buffers.
+    Files are written under a temporary name and renamed into place, so readers never see
+    a partial file. Call flush() before anything reads the files back or the track is done
+    """
+
+    def __init__(self, max_pending=16, workers=2):
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.lock = threading.Lock()
+        self._reset_stats()
+        self.threads = [threading.Thread(target=self._worker, name=f"write-behind-{i}", daemon=True)
+                        for i in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def _reset_stats(self):
+        self.stats = {'files': 0, 'bytes': 0, 'queue_wait': 0.0, 'write_time': 0.0, 'failed': []}
+
+    def write(self, path, data, samplerate, subtype=None, format=None):
+        """
+        Queue a soundfile write; same arguments as sf.write
+        The caller must not modify data afterwards
+        """
+        start = time.perf_counter()
+        self.pending.put((path, data, samplerate, subtype, format))
+        with self.lock:
+            self.stats['queue_wait'] += time.perf_counter() - start
+
+    def _worker(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                self.pending.task_done()
+                return
+            path, data, samplerate, subtype, format = item
+            # The temporary name hides the extension, so the format is passed explicitly
+            format = format or os.path.splitext(path)[1][1:].upper()
+            tmp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.{uuid.uuid4().hex[:8]}.part")
+            start = time.perf_counter()
+            try:
+                sf.write(tmp_path, data, samplerate, subtype=subtype, format=format)
+                os.replace(tmp_path, path)
+                with self.lock:
+                    self.stats['files'] += 1
+                    self.stats['bytes'] += os.path.getsize(path)
+            except Exception as e:
+                print(f"Error writing {path}: {e}")
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                with self.lock:
+                    self.stats['failed'].append(path)
+            finally:
+                with self.lock:
+                    self.stats['write_time'] += time.perf_counter() - start
+                self.pending.task_done()
+
+    def flush(self):
+        """
+        Barrier: wait until every queued write is on disk
+        Returns the stats since the previous flush (files, bytes, queue_wait and write_time
+        in seconds, failed paths) and starts counting anew
+        """
+        self.pending.join()
+        with self.lock:
+            stats = self.stats
+            self._reset_stats()
+        return stats
+
+    def close(self):
+        """Finish the queued writes and stop the writer threads"""
+        for _ in self.threads:
+            self.pending.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()